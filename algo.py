@@ -6,14 +6,18 @@
 import time
 import datetime as dt
 import numpy as np
-import pickle
+from collections import deque
 
 from param import DATE_FORMAT
-from algoFunctions import train, severityMetric, runnable
+from algoFunctions import trainFromStats, updatePosterior, severityMetric
+from algoFunctions import validData, expandModel
+from smoothing import Smoother
+from checkpoint import Checkpoint
 
 
 #==================== PARAMETERS ====================#
 X_BACKUP_FILENAME = 'X_backup.bak'
+REFRESH_BLOCK_ROWS = 4096   # Rows of X read at a time by refreshStats
 RESULTS_FILENAME = 'results.csv'
 
 
@@ -40,6 +44,20 @@ class Algo(object):
         # power on the end
         self.X = np.zeros([self.matrix_length, self.num_features+1])
 
+        # Sufficient statistics of the training window (Phi^T*Phi, Phi^T*t
+        # and t^T*t), kept up to date as rows enter and leave the window
+        self.PhiT_Phi = np.zeros([self.num_features, self.num_features])
+        self.PhiT_t = np.zeros(self.num_features)
+        self.tT_t = 0.0
+
+        # Number of valid (not -1) data points of each feature in the window
+        # The initial window of zeros counts as valid, as it does in runnable
+        self.valid_count = np.ones(self.num_features, dtype=int) * self.matrix_length
+
+        # Features with less valid data in the window than this fraction
+        # are left out of training (0 keeps every feature)
+        self.min_feature_coverage = 0.0
+
         # Regression and severity variables
         self.w_opt = []
         self.a_opt = 0
@@ -57,45 +75,151 @@ class Algo(object):
         self.Sn_1 = 0
         self.alert_counter = 0
         self.init_training = False
-        self.using_backup = False
         self.row_count = 0
         
-        # EMA parameter
+        # Smoothing of incoming rows (see smoothing.py), EMA by default
         self.alpha = 1.0
+        self.smoother = Smoother(self.num_features + 1, 'ema', alpha=self.alpha)
+
+        # Online mode: update w_opt and S_N with every new row between
+        # trainings. forgetting < 1 exponentially discounts older rows.
+        self.online = False
+        self.forgetting = 1.0
+
+        # Warm start: begin each training from the previous alpha/beta
+        # train_log keeps convergence statistics of recent training sessions
+        self.warm_start = False
+        self.train_log = deque(maxlen=100)
+
+        # Optional TrainingExecutor (see trainer.py). When set, training runs
+        # in a worker process and the new model is swapped in once it is done
+        self.executor = None
+        self.pending_training = None
 
-    # Read the previous training window from a backup file
+        # Rows added while a training job runs (online mode only); they are
+        # not in the job's statistics and are folded into its model on swap
+        self.pending_rows = []
+
+        # Time and row count of the data the current model was trained on
+        self.model_time = None
+        self.model_row_count = 0
+
+        # Optional Checkpoint (see checkpoint.py), saved every
+        # checkpoint_interval rows. When run() makes a prediction, the save
+        # waits for checkSeverity so that it includes that row's severity
+        self.checkpoint = None
+        self.checkpoint_interval = 1
+        self.checkpoint_due = False
+
+    # Start saving checkpoints of the analysis state to 'filename',
+    # replacing any previous backup there
+    # With memmap=True the training window X itself is kept in the backup
+    # as a memory-mapped file of type 'dtype' (np.float32 halves its size)
+    # instead of in RAM, see checkpoint.py
+    def setBackup(self, filename=X_BACKUP_FILENAME, interval=1, memmap=False,
+                  dtype=np.float64):
+        self.checkpoint = self._checkpoint(filename, memmap, dtype)
+        self.checkpoint.create()
+        self.checkpoint_interval = interval
+        if memmap:
+            self.checkpoint.window[:] = self.X
+            self.X = self.checkpoint.window
+            self.refreshStats()
+
+    # Restore the analysis state from the backup 'filename' and keep
+    # saving checkpoints to it. Nothing is replayed or re-trained.
     # Raises an exception if file does not exist or is not
     # properly formatted
-    def fromBackup(self, filename=X_BACKUP_FILENAME):
-
-        self.X_backup_file = filename
-        self.using_backup = True
+    # 'memmap' and 'dtype' must be the ones the backup was made with
+    def fromBackup(self, filename=X_BACKUP_FILENAME, interval=1, memmap=False,
+                   dtype=np.float64):
 
         # Exceptions are not ignored and allowed to propogate up
-        with open(filename, 'rb') as infile:
-            X_backup = pickle.load(infile)
-            if (np.shape(X_backup) == np.shape(self.X)):
-                # Add each row individually
-                for row in X_backup:
-                    self.run(row)
-            else:
-                raise RuntimeError("Backup not properly sized.")
+        checkpoint = self._checkpoint(filename, memmap, dtype)
+        try:
+            state, indices, rows = checkpoint.load()
+        except ValueError as error:
+            checkpoint.close()
+            raise RuntimeError("Backup does not match: %s" % error)
+        if ((state['num_features'], state['matrix_length']) !=
+                (self.num_features, self.matrix_length)):
+            checkpoint.close()
+            raise RuntimeError("Backup not properly sized.")
+        try:
+            self.smoother.restore(state['smoothing'])
+        except ValueError as error:
+            checkpoint.close()
+            raise RuntimeError("Backup smoothing settings do not match: %s" % error)
+
+        if memmap:
+            self.X = checkpoint.window
+        else:
+            self.X[:] = 0
+            self.X[indices % self.matrix_length] = rows
+        self.row_count = state['row_count']
+        self.refreshStats()
+        self.last_avg = self.smoother.last.copy()
+
+        self.w_opt = state['w_opt']
+        self.a_opt = state['a_opt']
+        self.b_opt = state['b_opt']
+        self.S_N = state['S_N']
+        self.mu = state['mu']
+        self.sigma = state['sigma']
+        self.Sn_1 = state['Sn_1']
+        self.alert_counter = state['alert_counter']
+        self.init_training = state['init_training']
+        self.model_row_count = state['model_row_count']
+
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = interval
+
+    def _checkpoint(self, filename, memmap, dtype):
+        return Checkpoint(filename, self.num_features + 1, self.matrix_length,
+                          window_dtype=dtype if memmap else None)
+
+    # Save the analysis state to the checkpoint (the rows themselves are
+    # logged by run()). The severity state is the one after the last
+    # call to checkSeverity.
+    def saveCheckpoint(self):
+        self.checkpoint_due = False
+        self.checkpoint.save({
+            'num_features': self.num_features,
+            'matrix_length': self.matrix_length,
+            'row_count': self.row_count,
+            'w_opt': self.w_opt,
+            'a_opt': self.a_opt,
+            'b_opt': self.b_opt,
+            'S_N': self.S_N,
+            'mu': self.mu,
+            'sigma': self.sigma,
+            'Sn_1': self.Sn_1,
+            'alert_counter': self.alert_counter,
+            'init_training': self.init_training,
+            'model_row_count': self.model_row_count,
+            'smoothing': self.smoother.state(),
+        })
 
     # Add new data, train
     def run(self, new_data):
+
+        # A save still waiting for checkSeverity (which was not called)
+        if self.checkpoint_due:
+            self.saveCheckpoint()
     
-        if self.row_count == 0:
-            self.last_avg = new_data
-        else:
-            new_data = (1 - self.alpha)*self.last_avg + self.alpha*new_data
-            self.last_avg = new_data[:]
+        new_data = self.smoother.smooth(new_data)
+        self.last_avg = new_data
         
         self.addData(new_data)
 
+        # Swap in a model finished by the executor, if any
+        self.collectTraining()
+
         # Check if it's time to train
+        trained = False
         if ( ((self.row_count % self.forecasting_interval) == 0) and
              ((self.row_count >= self.matrix_length) or self.init_training) ):
-            self.train()
+            trained = self.train()
 
         # Check if we can make a prediction
         if self.init_training:
@@ -110,10 +234,33 @@ class Algo(object):
             # Catching pathogenic cases where variance gets too small
             if self.sigma < 1: 
                 self.sigma = 1
+
+            # Fold the new row into the posterior after predicting it
+            # (a fresh training has already seen it)
+            if self.online and not trained:
+                self.w_opt, self.S_N = updatePosterior(self.w_opt, self.S_N, self.b_opt,
+                                                       x_test, target, self.forgetting)
                 
-            return target, prediction
+            result = (target, prediction)
         else:
-            return self.last_avg[-1], None
+            result = (self.last_avg[-1], None)
+
+        # Keep the rows a running training job has not seen (the row it
+        # was submitted on is already part of its statistics)
+        if (self.online and self.pending_training is not None and
+                self.pending_training[2] != self.row_count):
+            self.pending_rows.append(new_data)
+
+        # Save the state every checkpoint_interval rows (after the
+        # severity update if there is a prediction)
+        if (self.checkpoint is not None and
+                (self.row_count % self.checkpoint_interval) == 0):
+            if result[1] is None:
+                self.saveCheckpoint()
+            else:
+                self.checkpoint_due = True
+
+        return result
             
     # Update severity metric and check for anomaly
     # Return true if anomaly is detected, false otherwise
@@ -137,34 +284,154 @@ class Algo(object):
             #print "ERROR: ANOMALY"
 
         self.Sn_1 = Sn
+        if self.checkpoint_due:
+            self.saveCheckpoint()
         return anomaly_found
 
     # Add new row of data to the matrix
+    # The row being overwritten is removed from the sufficient statistics
+    # and the new row is added (rank-1 updates)
+    # Rows are read back from X in float64, so that the statistics match
+    # what is stored even if X is float32
     def addData(self, new_data):
         assert (len(new_data) == self.num_features + 1)
         current_row = self.row_count % self.matrix_length
+        old_row = np.array(self.X[current_row], dtype=float)
+        old_x = old_row[:self.num_features]
+        old_t = old_row[self.num_features]
+        self.PhiT_Phi -= np.outer(old_x, old_x)
+        self.PhiT_t -= old_t * old_x
+        self.tT_t -= old_t * old_t
+        self.valid_count -= validData(old_x)
+
+        if self.checkpoint is not None:
+            self.checkpoint.append(self.row_count, new_data)
         self.X[current_row] = new_data
+        new_row = np.array(self.X[current_row], dtype=float)
+        new_x = new_row[:self.num_features]
+        new_t = new_row[self.num_features]
+        self.PhiT_Phi += np.outer(new_x, new_x)
+        self.PhiT_t += new_t * new_x
+        self.tT_t += new_t * new_t
+        self.valid_count += validData(new_x)
         self.row_count += 1
 
+        # Recompute the statistics exactly once per pass through the window
+        # so that rounding errors from the updates cannot accumulate
+        if (self.row_count % self.matrix_length) == 0:
+            self.refreshStats()
+
+    # Recompute the sufficient statistics from the whole training window
+    # X is read REFRESH_BLOCK_ROWS rows at a time and accumulated in
+    # float64, so no full-size copy of the window is made even when it
+    # is a float32 memmap
+    def refreshStats(self):
+        M = self.num_features
+        self.PhiT_Phi = np.zeros([M, M])
+        self.PhiT_t = np.zeros(M)
+        self.tT_t = 0.0
+        self.valid_count = np.zeros(M, dtype=int)
+        for start in xrange(0, self.matrix_length, REFRESH_BLOCK_ROWS):
+            block = np.array(self.X[start:start + REFRESH_BLOCK_ROWS], dtype=float)
+            data = block[:, :M]
+            y = block[:, M]
+            self.PhiT_Phi += np.dot(np.transpose(data), data)
+            self.PhiT_t += np.dot(np.transpose(data), y)
+            self.tT_t += np.inner(y, y)
+            self.valid_count += np.sum(validData(data), axis=0)
+
+    # Return the fraction of valid data in the training window, overall
+    # and for each feature, from the counts kept by addData
+    def coverage(self):
+        per_feature = self.valid_count / float(self.matrix_length)
+        return np.mean(per_feature), per_feature
+
     # Train the model
+    # Training only needs the sufficient statistics of the window, so the
+    # ring buffer does not have to be unwrapped
+    # Features below min_feature_coverage are left out (their rows and
+    # columns are dropped from the statistics) and get zero weight
+    # Returns True if the model was updated, False if it was not trained
+    # or the training was handed to the executor
     def train(self):
-    
-        # Unwrap the matrices (put the most recent data on the bottom)
-        pivot = self.row_count % self.matrix_length
-        data = self.X[pivot:, :self.num_features]
-        data = np.concatenate((data, self.X[:pivot, :self.num_features]), axis=0)
-        y = self.X[pivot:, self.num_features]
-        y = np.concatenate((y, self.X[:pivot, self.num_features]), axis=0)
-
-        if (self.init_training or runnable(data) > 0.5):
-            #self.w_opt, self.a_opt, self.b_opt, self.S_N = normalTrain(data, y)
-            self.w_opt, self.a_opt, self.b_opt, self.S_N = train(data, y)
-            self.init_training = True
-            
-        # Log current training windows as pickle files
-        if self.using_backup:
-            with open(self.X_backup_file, 'wb') as outfile:
-                pickle.dump(self.X, outfile)
+
+        trained = False
+        overall, per_feature = self.coverage()
+        features = per_feature >= self.min_feature_coverage
+        if (np.any(features) and (self.init_training or overall > 0.5)):
+            warm = self.warm_start and self.init_training
+            ab_init = (self.a_opt, self.b_opt) if warm else None
+            start_time = time.time()
+            PhiT_Phi = self.PhiT_Phi[np.ix_(features, features)]
+            PhiT_t = self.PhiT_t[features]
+
+            if self.executor is not None:
+                # Only one job per detector at a time; if the previous one is
+                # still running this session is skipped
+                if self.pending_training is None:
+                    job = self.executor.submit(PhiT_Phi, PhiT_t,
+                                               self.tT_t, self.matrix_length, ab_init)
+                    self.pending_training = (job, start_time, self.row_count, warm, features)
+                    self.pending_rows = []
+            else:
+                w_opt, self.a_opt, self.b_opt, S_N, info = trainFromStats(
+                    PhiT_Phi, PhiT_t, self.tT_t, self.matrix_length,
+                    ab_init=ab_init, full_output=True)
+                self.w_opt, self.S_N = expandModel(features, w_opt, S_N)
+                info['duration'] = time.time() - start_time
+                info['warm_start'] = warm
+                info['row_count'] = self.row_count
+                info['excluded_features'] = list(np.flatnonzero(~features))
+                self.train_log.append(info)
+                self.model_time = start_time
+                self.model_row_count = self.row_count
+                self.init_training = True
+                trained = True
+
+        return trained
+
+    # Swap in the model computed by the executor once its job is done
+    # The whole posterior is replaced at once, between two predictions
+    # In online mode the rows added since the job was submitted are folded
+    # into the new posterior, as they were into the old one
+    def collectTraining(self):
+        if self.pending_training is None or not self.pending_training[0].ready():
+            return
+
+        job, submit_time, row_count, warm, features = self.pending_training
+        self.pending_training = None
+        pending_rows, self.pending_rows = self.pending_rows, []
+        success, result = job.get()
+        if not success:
+            print "Training failed:", result
+            return
+
+        w_opt, self.a_opt, self.b_opt, S_N, info = result
+        self.w_opt, self.S_N = expandModel(features, w_opt, S_N)
+        for row in pending_rows:
+            self.w_opt, self.S_N = updatePosterior(self.w_opt, self.S_N, self.b_opt,
+                                                   row[:-1], row[-1], self.forgetting)
+        info['duration'] = time.time() - submit_time
+        info['warm_start'] = warm
+        info['row_count'] = row_count
+        info['excluded_features'] = list(np.flatnonzero(~features))
+        self.train_log.append(info)
+        self.model_time = submit_time
+        self.model_row_count = row_count
+        self.init_training = True
+
+    # Return statistics about background training and the age of the model:
+    # the executor's queue depth and job latency, and how long ago (seconds
+    # and rows) the data used for the current model was collected
+    def trainingMetrics(self):
+        metrics = {}
+        if self.executor is not None:
+            metrics.update(self.executor.metrics())
+        metrics['training_pending'] = self.pending_training is not None
+        if self.model_time is not None:
+            metrics['model_age'] = time.time() - self.model_time
+            metrics['model_age_rows'] = self.row_count - self.model_row_count
+        return metrics
 
     # Make a prediction based on new data
     def prediction(self, new_data):
@@ -179,7 +446,37 @@ class Algo(object):
         print "w = %.3f, L = %.3f, THRESHOLD = %.3f" % (self.w, self.L,self.THRESHOLD)
         
     def setEMAParameter(self, alpha):
+        self.setSmoothing('ema', alpha=alpha)
+
+    # Change how incoming rows are smoothed: 'ema' (with alpha), 'boxcar'
+    # or 'median' (over the last window rows) or 'none'
+    def setSmoothing(self, method, window=1, alpha=1.0):
         self.alpha = alpha
-        print "alpha: %.3f" % alpha
+        self.smoother = Smoother(self.num_features + 1, method, window, alpha)
+        print "smoothing: %s, window = %d, alpha = %.3f" % (method, window, alpha)
+
+    # Run training sessions on a TrainingExecutor (see trainer.py) instead
+    # of inside run(); None goes back to training synchronously
+    def setExecutor(self, executor):
+        self.executor = executor
+
+    # Enable or disable warm-starting training from the previous alpha/beta
+    def setWarmStart(self, warm_start):
+        self.warm_start = warm_start
+        print "warm start: %s" % warm_start
+
+    # Leave features with less than this fraction of valid data in the
+    # training window out of training (0 trains on every feature)
+    def setFeatureCoverage(self, min_feature_coverage):
+        assert (0 <= min_feature_coverage <= 1)
+        self.min_feature_coverage = min_feature_coverage
+        print "minimum feature coverage: %.3f" % min_feature_coverage
+
+    # Enable or disable online posterior updates between trainings
+    def setOnlineParameters(self, online, forgetting=1.0):
+        assert (0 < forgetting <= 1)
+        self.online = online
+        self.forgetting = forgetting
+        print "online: %s, forgetting = %.3f" % (online, forgetting)
 
 
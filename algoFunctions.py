@@ -7,8 +7,6 @@ import os
 import sys
 import time
 import numpy as np
-import scipy as sp
-import scipy.stats
 import csv
 import json
 from urllib import urlopen
@@ -22,83 +20,223 @@ def movingAverage(interval, window_size):
     return np.convolve(interval, window, 'same')
     
 
+# Returns a boolean array, True where the data is valid
+# Invalid or missing sensor data is marked with -1
+def validData(arrayIn):
+    return np.trunc(arrayIn) != -1
+
+
 # Returns the percentage of valid data points in the array
 # Used to determine of the data is valid enough to train on
 def runnable(arrayIn):
-    countAll = 0
-    countValid = 0
-    for row in arrayIn:
-        for datum in row:
-            countAll += 1
-            if int(datum) is not -1:
-                countValid += 1
-    return float(countValid)/countAll
+    return coverage(arrayIn)[0]
+
+
+# Returns the fraction of valid data points in the whole array and
+# the fraction of valid data points in each column (feature)
+def coverage(arrayIn):
+    valid = validData(np.asarray(arrayIn, dtype=float))
+    return np.mean(valid), np.mean(valid, axis=0)
+
+
+# Expands a model trained on some of the features (boolean mask 'features')
+# back to all features. Excluded features get zero weight and zero posterior
+# covariance, so their (invalid) data has no effect on predictions
+def expandModel(features, w_opt, S_N):
+    M = len(features)
+    w_full = np.zeros(M)
+    w_full[features] = w_opt
+    S_full = np.zeros([M, M])
+    S_full[np.ix_(features, features)] = S_N
+    return w_full, S_full
     
     
 # This function is used for training our Bayesian model
 # Returns the regression parameters w_opt, and alpha, beta, S_N
-# needed for the predictive distribution    
-def train(X, y):
+# needed for the predictive distribution
+#
+# 'ab_init' is an optional (alpha, beta) pair to start the iterations from
+# (warm start), e.g. the solution of the previous training session.
+# If 'full_output' is True, a dictionary describing the convergence
+# ('iterations', 'residual', 'converged') is returned as a fifth value.
+def train(X, y, ab_init=None, full_output=False):
 
     Phi = X # the measurement matrix of the input variables x (i.e., features)
     t   = y # the vector of observations for the target variable
     (N, M) = np.shape(Phi)
+
+    PhiT_Phi = np.dot(np.transpose(Phi), Phi)
+    PhiT_t = np.dot(np.transpose(Phi), t)
+
+    def sumSquaredError(m_N):
+        residual = t - np.dot(Phi, m_N)
+        return np.inner(residual, residual)
+
+    return _maximizeEvidence(PhiT_Phi, PhiT_t, N, sumSquaredError, ab_init, full_output)
+
+
+# Same as train(), but works from the sufficient statistics of the training
+# window (PhiT_Phi, PhiT_t, tT_t and the number of rows N) instead of the
+# data itself, so the cost does not depend on N
+def trainFromStats(PhiT_Phi, PhiT_t, tT_t, N, ab_init=None, full_output=False):
+
+    def sumSquaredError(m_N):
+        # ||t - Phi*m||^2 expanded in terms of the statistics
+        sse = tT_t - 2*np.inner(m_N, PhiT_t) + np.inner(m_N, np.dot(PhiT_Phi, m_N))
+        return max(sse, 0)
+
+    return _maximizeEvidence(PhiT_Phi, PhiT_t, N, sumSquaredError, ab_init, full_output)
+
+
+# Evidence maximization shared by train() and trainFromStats()
+# sumSquaredError(m_N) must return the residual sum of squares of m_N
+#
+# PhiT_Phi is eigendecomposed once per training session. In that eigenbasis
+# alpha*I + beta*PhiT_Phi is diagonal, so every alpha/beta iteration only
+# needs O(M^2) work instead of a fresh O(M^3) pseudo-inverse.
+def _maximizeEvidence(PhiT_Phi, PhiT_t, N, sumSquaredError, ab_init=None, full_output=False):
+
     # Init values for  hyper-parameters alpha, beta
-    alpha = 5*10**(-3)
-    beta = 5
+    if ab_init is None:
+        alpha = 5*10**(-3)
+        beta = 5
+    else:
+        alpha, beta = ab_init
     max_iter = 100
     k = 0
 
-    PhiT_Phi = np.dot(np.transpose(Phi), Phi)
-    s = np.linalg.svd(PhiT_Phi, compute_uv=0) # Just get the vector of singular values s
+    # PhiT_Phi = V * diag(lam) * V^T, lam are the eigenvalues of PhiT_Phi
+    lam, V = _eigh(PhiT_Phi)
+    VT_PhiT_t = np.dot(np.transpose(V), PhiT_t)
 
     ab_old = np.array([alpha, beta])
     ab_new = np.zeros((1,2))
     tolerance = 10**-3
     while( k < max_iter and np.linalg.norm(ab_old-ab_new) > tolerance):
         k += 1
-        try:
-
-            S_N = np.linalg.pinv(alpha*np.eye(M) + beta*PhiT_Phi)
-        except np.linalg.LinAlgError as err:
-            print  "******************************************************************************************************"
-            print "                           ALERT: LinearAlgebra Error detected!"
-            print "      CHECK if your measurement matrix is not leading to a singular alpha*np.eye(M) + beta*PhiT_Phi"
-            print "                           GOODBYE and see you later. Exiting ..."
-            print  "******************************************************************************************************"
-            sys.exit(-1)
-
-        m_N = beta * np.dot(S_N, np.dot(np.transpose(Phi), t))
-        gamma = sum(beta*s[i]**2 /(alpha + beta*s[i]**2) for i in range(M))
+
+        # Eigenvalues of S_N are 1/(alpha + beta*lam)
+        d = 1.0 / (alpha + beta*lam)
+        m_N = beta * np.dot(V, d * VT_PhiT_t)
+        gamma = np.sum(beta * lam * d)
         #
         # update alpha, beta
         #
         ab_old = np.array([alpha, beta])
         alpha = gamma /np.inner(m_N,m_N)
-        one_over_beta = 1/(N-gamma) * sum( (t[n] - np.inner(m_N, Phi[n]))**2 for n in range(N))
+        one_over_beta = sumSquaredError(m_N) / (N-gamma)
         beta = 1/one_over_beta
         ab_new = np.array([alpha, beta])
 
-    S_N = np.linalg.pinv(alpha*np.eye(M) + beta*PhiT_Phi)
-    m_N = beta * np.dot(S_N, np.dot(np.transpose(Phi), t))
+    d = 1.0 / (alpha + beta*lam)
+    S_N = np.dot(V * d, np.transpose(V))
+    m_N = beta * np.dot(V, d * VT_PhiT_t)
     w_opt = m_N
 
+    if full_output:
+        residual = np.linalg.norm(ab_old-ab_new)
+        info = {'iterations': k,
+                'residual': residual,
+                'converged': residual <= tolerance}
+        return (w_opt, alpha, beta, S_N, info)
+
     return (w_opt, alpha, beta, S_N)
 
+
+# Batched version of trainFromStats() for K independent training windows
+# PhiT_Phi is (K, M, M), PhiT_t is (K, M), tT_t is (K,) and N is the number
+# of rows in each window. 'ab_init' is an optional (alpha, beta) pair of
+# (K,) arrays to warm start from.
+# Returns the stacked w_opt (K, M), alpha (K,), beta (K,), S_N (K, M, M);
+# each stream gets the same result trainFromStats() would give it.
+def trainBatchFromStats(PhiT_Phi, PhiT_t, tT_t, N, ab_init=None):
+
+    K = len(PhiT_Phi)
+    if ab_init is None:
+        alpha = np.ones(K) * 5*10**(-3)
+        beta = np.ones(K) * 5.0
+    else:
+        alpha = np.array(ab_init[0], dtype=float)
+        beta = np.array(ab_init[1], dtype=float)
+    max_iter = 100
+    k = 0
+
+    lam, V = _eigh(PhiT_Phi)
+    VT_PhiT_t = np.einsum('kji,kj->ki', V, PhiT_t)
+
+    # Every stream iterates until its own alpha/beta have converged
+    ab_old = np.column_stack((alpha, beta))
+    ab_new = np.zeros((K, 2))
+    tolerance = 10**-3
+    active = np.linalg.norm(ab_old-ab_new, axis=1) > tolerance
+    while( k < max_iter and np.any(active) ):
+        k += 1
+
+        d = 1.0 / (alpha[:, np.newaxis] + beta[:, np.newaxis]*lam)
+        m_N = beta[:, np.newaxis] * np.einsum('kij,kj->ki', V, d * VT_PhiT_t)
+        gamma = np.sum(beta[:, np.newaxis] * lam * d, axis=1)
+
+        sse = (tT_t - 2*np.einsum('ki,ki->k', m_N, PhiT_t)
+                    + np.einsum('ki,kij,kj->k', m_N, PhiT_Phi, m_N))
+        sse = np.maximum(sse, 0)
+
+        ab_old = np.column_stack((alpha, beta))
+        alpha = np.where(active, gamma / np.einsum('ki,ki->k', m_N, m_N), alpha)
+        beta = np.where(active, (N-gamma) / sse, beta)
+        ab_new = np.column_stack((alpha, beta))
+        active = active & (np.linalg.norm(ab_old-ab_new, axis=1) > tolerance)
+
+    d = 1.0 / (alpha[:, np.newaxis] + beta[:, np.newaxis]*lam)
+    S_N = np.einsum('kij,kj,klj->kil', V, d, V)
+    m_N = beta[:, np.newaxis] * np.einsum('kij,kj->ki', V, d * VT_PhiT_t)
+    w_opt = m_N
+
+    return (w_opt, alpha, beta, S_N)
+
+
+# Eigendecomposition of PhiT_Phi (or a stack of them) used for training
+# Negative eigenvalues can only come from rounding since PhiT_Phi is
+# positive semi-definite, so they are set to zero
+def _eigh(PhiT_Phi):
+    try:
+        lam, V = np.linalg.eigh(PhiT_Phi)
+    except np.linalg.LinAlgError as err:
+        print  "******************************************************************************************************"
+        print "                           ALERT: LinearAlgebra Error detected!"
+        print "      CHECK if your measurement matrix is not leading to a singular alpha*np.eye(M) + beta*PhiT_Phi"
+        print "                           GOODBYE and see you later. Exiting ..."
+        print  "******************************************************************************************************"
+        sys.exit(-1)
+    return np.maximum(lam, 0), V
+
+
+# Recursive (online) update of the posterior mean m_N and covariance S_N
+# after observing a single new data point (x, t) with noise precision beta.
+# This is the Sherman-Morrison form of adding one row to the training set,
+# and costs O(M^2) instead of a full re-training.
+# 'forgetting' (0 < forgetting <= 1) exponentially discounts old data by
+# inflating the covariance before the update; 1 means no forgetting.
+def updatePosterior(m_N, S_N, beta, x, t, forgetting=1.0):
+
+    S_N = S_N / forgetting
+    Sx = np.dot(S_N, x)
+    gain = Sx / (1/beta + np.inner(x, Sx))
+    m_N = m_N + gain * (t - np.inner(x, m_N))
+    S_N = S_N - np.outer(gain, Sx)
+    S_N = (S_N + np.transpose(S_N)) / 2 # keep S_N symmetric
+
+    return m_N, S_N
+
     
 # Returns the Variance (Sn) and Z-Scores (Zt) of the EWMA control char
 # as described by the paper
+#
+# Mapping the error through the N(mu, sigma) cdf and back through the
+# N(0,1) inverse cdf is just the standardization (error - mu)/sigma,
+# so the Z-score is computed directly
 def severityMetric(error, mu, sigma, w, Sn_1):
 
-    # Left-tailed
-    if error < mu:
-        p_value = sp.stats.norm.cdf(error, mu, sigma)
-        Zt = sp.stats.norm.ppf(p_value) # inverse of cdf N(0,1)
-        
-    # Right-tailed
-    else:
-        p_value = 1 - sp.stats.norm.cdf(error, mu, sigma)
-        Zt = sp.stats.norm.ppf(1-p_value) # inverse of cdf N(0,1)
+    Zt = (error - mu) / float(sigma)
 
     if Zt > 10:
         Zt = 10
@@ -108,13 +246,55 @@ def severityMetric(error, mu, sigma, w, Sn_1):
     Sn = (1-w)*Sn_1 + w*Zt
 
     if debug:
-        if np.abs(Zt) > 90:
-            print "Error = %d, p-value=%.3f, Z-score=%.3f, Sn_1=%.2f, Sn=%.2f " % (error, p_value, Zt, Sn_1, Sn)
-        elif np.abs(Zt) < 0.005:
-            print "Error = %d, p-value=%.3f, Z-score=%.3f, Sn_1=%.2f, Sn=%.2f " % (error, p_value, Zt, Sn_1, Sn)
+        if np.abs(Zt) < 0.005:
+            print "Error = %d, Z-score=%.3f, Sn_1=%.2f, Sn=%.2f " % (error, Zt, Sn_1, Sn)
 
     return Sn, Zt
 
+
+# Array version of severityMetric combined with the two-in-a-row alert
+# logic of Algo.checkSeverity
+# 'errors' and 'sigmas' have time along the first axis; any further axes
+# are independent streams, e.g. shape (T, K) for K detectors
+# 'Sn_1' and 'alert_counter' are the state before the first sample
+# Returns the series Sn, Zt and anomalies, as well as the final
+# (Sn_1, alert_counter) so that the next batch can continue from it
+def severitySeries(errors, sigmas, w, L, mu=0, Sn_1=0, alert_counter=0):
+
+    errors = np.asarray(errors, dtype=float)
+    THRESHOLD = L * np.sqrt(w/(2-w))
+    Zt = np.clip((errors - mu) / sigmas, -10, 10)
+    T = len(Zt)
+
+    Sn_1 = np.zeros(Zt.shape[1:]) + Sn_1
+    alert_counter = np.zeros(Zt.shape[1:], dtype=int) + alert_counter
+    if T == 0:
+        return Zt.copy(), Zt, np.zeros(Zt.shape, dtype=bool), Sn_1, alert_counter
+
+    if w == 1:
+        # Sn is just Zt, so every step only depends on the previous one:
+        # the counter before step n is whether step n-1 exceeded the threshold
+        exceed = np.abs(Zt) > THRESHOLD
+        counter = np.concatenate((alert_counter[np.newaxis] == 1, exceed[:-1]))
+        anomalies = exceed & counter
+        first = exceed & ~counter
+        Sn_prev = np.concatenate((Sn_1[np.newaxis], Zt[:-1]))
+        Sn = np.where(anomalies, 0, np.where(first, Sn_prev, Zt))
+        return Sn, Zt, anomalies, Sn[-1], exceed[-1].astype(int)
+
+    # Otherwise Sn is recursive; step through time, all streams at once
+    Sn = np.empty(Zt.shape)
+    anomalies = np.empty(Zt.shape, dtype=bool)
+    for n in range(T):
+        S = (1-w)*Sn_1 + w*Zt[n]
+        exceed = np.abs(S) > THRESHOLD
+        anomalies[n] = exceed & (alert_counter == 1)
+        first = exceed & (alert_counter == 0)
+        Sn[n] = np.where(anomalies[n], 0, np.where(first, Sn_1, S))
+        alert_counter = exceed.astype(int)
+        Sn_1 = Sn[n]
+    return Sn, Zt, anomalies, Sn_1, alert_counter
+
             
 # Calculates the f1-scores for the given sets
 # 'detected' is a set containing the timestamps for all detected anomalies
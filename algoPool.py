@@ -0,0 +1,216 @@
+# Batched BLR algorithm for many data streams
+# Filename:     algoPool.py
+# Author(s):    based on algo.py by apadin, dvorva, mjmor, yabskbd
+# Start Date:   2026-10-17
+
+import numpy as np
+
+from algoFunctions import trainBatchFromStats, severitySeries, validData
+from smoothing import Smoother
+
+
+#==================== ALGOPOOL CLASS ====================#
+# This class runs the same BLR analysis as Algo for K independent streams
+# (e.g. one per home) that share the same settings and number of features.
+# All state is kept in stacked NumPy arrays with the stream on the first
+# axis, so a single call to run() / checkSeverity() handles every stream
+# and due streams are re-trained together with batched linear algebra.
+# All streams receive one new row per call and so stay in step.
+class AlgoPool(object):
+
+    # Constructor
+    def __init__(self, num_streams, granularity, training_window, forecasting_interval, num_features):
+
+        # num_streams           -> number of independent data streams (K)
+        # granularity           -> time between measurements
+        # matrix_length         -> number of data points to train on
+        # forecasting_interval  -> number of data points between re-training sessions
+        # num_features          -> number of features to train on
+        self.num_streams = int(num_streams)
+        self.granularity = int(granularity)
+        self.granularity_in_seconds = int(granularity * 60)
+        self.matrix_length = int(training_window * (60 / granularity))
+        self.forecasting_interval = int(forecasting_interval * (60 / granularity))
+        self.num_features = num_features
+
+        K, L, M = self.num_streams, self.matrix_length, self.num_features
+
+        # X matrices - one (matrix_length x num_features+1) window per stream
+        self.X = np.zeros([K, L, M+1])
+
+        # Sufficient statistics of each training window (see Algo)
+        self.PhiT_Phi = np.zeros([K, M, M])
+        self.PhiT_t = np.zeros([K, M])
+        self.tT_t = np.zeros(K)
+
+        # Number of valid (not -1) data points of each feature in each
+        # window (see Algo); the initial windows of zeros count as valid
+        self.valid_count = np.ones([K, M], dtype=int) * L
+
+        # Features with less valid data in a window than this fraction
+        # are left out of that stream's training (0 keeps every feature)
+        self.min_feature_coverage = 0.0
+
+        # Regression and severity variables
+        self.w_opt = np.zeros([K, M])
+        self.a_opt = np.zeros(K)
+        self.b_opt = np.zeros(K)
+        self.S_N = np.zeros([K, M, M])
+
+        self.mu = 0
+        self.sigma = np.ones(K) * 1000
+
+        self.w, self.L = (1.00, 3.719) # Least sensitive
+        self.THRESHOLD = self.L * np.sqrt(self.w/(2-self.w))
+        self.Sn_1 = np.zeros(K)
+        self.alert_counter = np.zeros(K, dtype=int)
+        self.init_training = np.zeros(K, dtype=bool)
+        self.row_count = 0
+
+        # Smoothing of incoming rows (see smoothing.py), EMA by default
+        self.alpha = 1.0
+        self.smoother = Smoother((K, M+1), 'ema', alpha=self.alpha)
+
+    # Add a new row to every stream, train the due streams and predict
+    # new_data is (num_streams x num_features+1)
+    # Returns the arrays (targets, predictions); predictions are NaN
+    # for streams that have not been trained yet
+    def run(self, new_data):
+
+        new_data = self.smoother.smooth(new_data)
+        self.last_avg = new_data
+
+        self.addData(new_data)
+
+        # Check if it's time to train
+        if (self.row_count % self.forecasting_interval) == 0:
+            if self.row_count >= self.matrix_length:
+                self.train()
+            elif np.any(self.init_training):
+                self.train(self.init_training)
+
+        x_test = new_data[:, :self.num_features]
+        targets = new_data[:, self.num_features]
+        predictions = np.ones(self.num_streams) * np.nan
+
+        # Predict for all trained streams
+        ready = self.init_training
+        if np.any(ready):
+            x = x_test[ready]
+            predictions[ready] = np.maximum(0, np.einsum('ki,ki->k', x, self.w_opt[ready]))
+
+            # Update variance (sigma), never smaller than 1
+            variance = 1/self.b_opt[ready] + np.einsum('ki,kij,kj->k', x, self.S_N[ready], x)
+            self.sigma[ready] = np.maximum(1, np.sqrt(variance))
+
+        return targets, predictions
+
+    # Update severity metric and check for anomalies in every stream
+    # Returns a boolean array, True where an anomaly is detected.
+    # Streams without a prediction (NaN) keep their state.
+    def checkSeverity(self, targets, predictions):
+        ready = ~np.isnan(predictions)
+        errors = (predictions - targets)[np.newaxis, ready]
+        Sn, Zt, anomalies, Sn_1, alert_counter = severitySeries(
+            errors, self.sigma[ready], self.w, self.L, self.mu,
+            self.Sn_1[ready], self.alert_counter[ready])
+
+        self.Sn_1[ready] = Sn_1
+        self.alert_counter[ready] = alert_counter
+        anomaly_found = np.zeros(self.num_streams, dtype=bool)
+        anomaly_found[ready] = anomalies[0]
+        return anomaly_found
+
+    # Add a new row of data to the matrix of every stream
+    def addData(self, new_data):
+        assert (np.shape(new_data) == (self.num_streams, self.num_features + 1))
+        M = self.num_features
+        current_row = self.row_count % self.matrix_length
+        old_x = self.X[:, current_row, :M]
+        old_t = self.X[:, current_row, M]
+        self.PhiT_Phi -= np.einsum('ki,kj->kij', old_x, old_x)
+        self.PhiT_t -= old_t[:, np.newaxis] * old_x
+        self.tT_t -= old_t * old_t
+        self.valid_count -= validData(old_x)
+
+        self.X[:, current_row] = new_data
+        new_x = self.X[:, current_row, :M]
+        new_t = self.X[:, current_row, M]
+        self.PhiT_Phi += np.einsum('ki,kj->kij', new_x, new_x)
+        self.PhiT_t += new_t[:, np.newaxis] * new_x
+        self.tT_t += new_t * new_t
+        self.valid_count += validData(new_x)
+        self.row_count += 1
+
+        if (self.row_count % self.matrix_length) == 0:
+            self.refreshStats()
+
+    # Recompute the sufficient statistics from the whole training windows
+    def refreshStats(self):
+        data = self.X[:, :, :self.num_features]
+        y = self.X[:, :, self.num_features]
+        self.PhiT_Phi = np.einsum('kni,knj->kij', data, data)
+        self.PhiT_t = np.einsum('kni,kn->ki', data, y)
+        self.tT_t = np.einsum('kn,kn->k', y, y)
+        self.valid_count = np.sum(validData(data), axis=1)
+
+    # Return the fraction of valid data in each training window, overall
+    # and for each feature, from the counts kept by addData
+    def coverage(self):
+        per_feature = self.valid_count / float(self.matrix_length)
+        return np.mean(per_feature, axis=1), per_feature
+
+    # Train the models of the given streams (boolean mask, default all)
+    # Streams that were never trained need more than half of their
+    # feature data to be valid (see algoFunctions.runnable)
+    # Features below min_feature_coverage are left out of their stream's
+    # training and get zero weight, as in Algo.train. Their rows and
+    # columns of the statistics are zeroed instead of dropped, so that
+    # every stream keeps the same size for the stacked solve; directions
+    # without data add nothing to the evidence (see trainBatchFromStats)
+    def train(self, streams=None):
+        if streams is None:
+            streams = np.ones(self.num_streams, dtype=bool)
+
+        overall, per_feature = self.coverage()
+        features = per_feature >= self.min_feature_coverage
+        due = (streams & np.any(features, axis=1) &
+               (self.init_training | (overall > 0.5)))
+        if not np.any(due):
+            return
+
+        features = features[due]
+        pairs = features[:, :, np.newaxis] & features[:, np.newaxis, :]
+        w_opt, a_opt, b_opt, S_N = trainBatchFromStats(
+            self.PhiT_Phi[due] * pairs, self.PhiT_t[due] * features,
+            self.tT_t[due], self.matrix_length)
+        w_opt *= features
+        S_N *= pairs
+        self.w_opt[due] = w_opt
+        self.a_opt[due] = a_opt
+        self.b_opt[due] = b_opt
+        self.S_N[due] = S_N
+        self.init_training[due] = True
+
+    # Change the severity parameters (omega w and lambda L)
+    def setSeverityParameters(self, w, L):
+        self.w = w
+        self.L = L
+        self.THRESHOLD = self.L * np.sqrt(self.w/(2-self.w))
+        print "w = %.3f, L = %.3f, THRESHOLD = %.3f" % (self.w, self.L,self.THRESHOLD)
+
+    def setEMAParameter(self, alpha):
+        self.setSmoothing('ema', alpha=alpha)
+
+    # Leave features with less valid data than this fraction of the
+    # window out of training (see Algo.setFeatureCoverage)
+    def setFeatureCoverage(self, min_feature_coverage):
+        assert (0 <= min_feature_coverage <= 1)
+        self.min_feature_coverage = min_feature_coverage
+        print "minimum feature coverage: %.3f" % min_feature_coverage
+
+    # Change how incoming rows are smoothed (see Algo.setSmoothing)
+    def setSmoothing(self, method, window=1, alpha=1.0):
+        self.alpha = alpha
+        self.smoother = Smoother((self.num_streams, self.num_features + 1), method, window, alpha)
+        print "smoothing: %s, window = %d, alpha = %.3f" % (method, window, alpha)
@@ -0,0 +1,197 @@
+# Filename:     checkpoint.py
+# Author(s):    based on algo.py by apadin, dvorva, mjmor, yabskbd
+# Start Date:   2026-10-17
+
+"""Crash-safe checkpoints of the analysis state.
+
+Pickling the whole training window after every training is slow, and a
+crash during the write leaves a broken backup. Replaying the rows of a
+backup through Algo.run on restart also re-runs trainings. A Checkpoint
+is made of two files instead:
+
+ * <filename>.rows   append-only log of the rows of the training window,
+                     one fixed-width record (row index, row values) per
+                     row. It is compacted to the window of the last saved
+                     state (and the rows logged since) by writing a new
+                     file and renaming it into place.
+ * <filename>        small pickle of everything else (posterior, severity
+                     and smoothing state, row count), replaced atomically
+                     on every save.
+
+The rows log is synced to disk before the state is saved, so the state
+never refers to rows that are not on disk. Rows logged after the last
+save are ignored on restore. Restoring reads both files and needs no
+replay (see Algo.fromBackup).
+
+For long training windows, the rows can be kept in a window file,
+<filename>.window, instead: the whole training window as a memory-mapped
+array, optionally stored as float32 ('window_dtype'). Algo then uses
+that array as its ring buffer X, so the window is never held in RAM.
+The rows log then only holds the rows that new rows have overwritten
+since the last save (an undo log, synced before each overwrite). On
+restore they are put back, so the window is again the one the saved
+state refers to. The window is flushed to disk before every save, after
+which the undo log is emptied.
+
+"""
+
+
+#==================== LIBRARIES ====================#
+import os
+import pickle
+import numpy as np
+
+
+#==================== CLASSES ====================#
+
+class Checkpoint(object):
+
+    def __init__(self, filename, num_columns, matrix_length, window_dtype=None):
+        """Checkpoint in 'filename' for rows of 'num_columns' values and a
+        training window of 'matrix_length' rows. If 'window_dtype' is given,
+        the rows are kept in a window file of that type instead of a rows
+        log (see 'window'). Call create() or load() before appending rows."""
+        self.filename = filename
+        self.rows_filename = filename + '.rows'
+        self.window_filename = filename + '.window'
+        self.num_columns = num_columns
+        self.matrix_length = matrix_length
+        self.dtype = np.dtype([('index', '<i8'), ('row', '<f8', (num_columns,))])
+        self.rows_file = None
+        self.row_count = 0          # Number of records in the rows log
+        self.compact_count = 0      # Compact the log when it has this many records
+        self.saved_row_count = 0    # Row count of the last saved state
+
+        self.window_dtype = None if window_dtype is None else np.dtype(window_dtype)
+        self.window = None  # Memory-mapped training window, in window mode
+
+    def create(self):
+        """Start a new, empty checkpoint, replacing any previous one."""
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        if self.window_dtype is not None:
+            self.window = np.memmap(self.window_filename, dtype=self.window_dtype, mode='w+',
+                                    shape=(self.matrix_length, self.num_columns))
+        self._replaceRows(np.zeros(0, dtype=self.dtype))
+
+    def load(self):
+        """
+        Return (state, indices, rows): the last saved state and the rows of
+        the training window it refers to, with their row indices. Rows
+        logged after the state was saved are dropped from the log. In
+        window mode no rows are returned; 'window' is rolled back to the
+        saved state and holds them.
+        Raises IOError if there is no checkpoint, and ValueError if it was
+        saved with another kind or size of window.
+        """
+        with open(self.filename, 'rb') as infile:
+            state = pickle.load(infile)
+        if state.get('window_dtype') != _dtypeName(self.window_dtype):
+            raise ValueError("backup window type does not match")
+
+        records = self._readRows()
+        row_count = state['row_count']
+        self.saved_row_count = row_count
+
+        if self.window_dtype is not None:
+            shape = (self.matrix_length, self.num_columns)
+            size = self.matrix_length * self.num_columns * self.window_dtype.itemsize
+            if os.path.getsize(self.window_filename) != size:
+                raise ValueError("backup window not properly sized")
+            self.window = np.memmap(self.window_filename, dtype=self.window_dtype, mode='r+',
+                                    shape=shape)
+            # Undo the overwrites of rows added after the state was saved
+            for record in records[::-1]:
+                if record['index'] >= row_count:
+                    self.window[record['index'] % self.matrix_length] = record['row']
+            self.window.flush()
+            self._replaceRows(np.zeros(0, dtype=self.dtype))
+            return state, np.zeros(0, dtype=int), np.zeros([0, self.num_columns])
+
+        keep = ((records['index'] < row_count) &
+                (records['index'] >= row_count - self.matrix_length))
+        records = records[keep]
+        self._replaceRows(records)
+        return state, records['index'], records['row']
+
+    def append(self, index, row):
+        """Log row number 'index' of the data. Must be called before the
+        row is stored; in window mode this logs the row it overwrites."""
+        record = np.zeros(1, dtype=self.dtype)
+        record['index'] = index
+        if self.window is not None:
+            record['row'] = self.window[index % self.matrix_length]
+            self.rows_file.write(record.tostring())
+            self.rows_file.flush()
+            os.fsync(self.rows_file.fileno())
+            self.row_count += 1
+            return
+
+        record['row'] = row
+        self.rows_file.write(record.tostring())
+        self.row_count += 1
+        if self.row_count >= self.compact_count:
+            # Keep every row the saved state may still need on restore
+            self.rows_file.flush()
+            records = self._readRows()
+            keep = records['index'] >= self.saved_row_count - self.matrix_length
+            self._replaceRows(records[keep])
+
+    def save(self, state):
+        """Atomically save the dictionary 'state' (must contain 'row_count')."""
+        if self.window is not None:
+            self.window.flush()
+        else:
+            self.rows_file.flush()
+            os.fsync(self.rows_file.fileno())
+        state = dict(state, window_dtype=_dtypeName(self.window_dtype))
+        atomicPickle(state, self.filename)
+        self.saved_row_count = state['row_count']
+        if self.window is not None:
+            self._replaceRows(np.zeros(0, dtype=self.dtype))
+
+    def close(self):
+        if self.rows_file is not None:
+            self.rows_file.close()
+            self.rows_file = None
+        if self.window is not None:
+            self.window.flush()
+
+    def _readRows(self):
+        """Return all complete records of the rows log."""
+        if not os.path.exists(self.rows_filename):
+            return np.zeros(0, dtype=self.dtype)
+        count = os.path.getsize(self.rows_filename) // self.dtype.itemsize
+        with open(self.rows_filename, 'rb') as infile:
+            return np.fromfile(infile, dtype=self.dtype, count=count)
+
+    def _replaceRows(self, records):
+        """Atomically replace the rows log with 'records' and reopen it."""
+        self.close()
+        temp_filename = self.rows_filename + '.tmp'
+        with open(temp_filename, 'wb') as outfile:
+            outfile.write(records.tostring())
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.rename(temp_filename, self.rows_filename)
+        self.rows_file = open(self.rows_filename, 'ab')
+        self.row_count = len(records)
+        self.compact_count = max(2 * self.matrix_length, len(records) + self.matrix_length)
+
+
+#==================== FUNCTIONS ====================#
+
+def _dtypeName(dtype):
+    """Name of a window type as saved in the state (None for a rows log)."""
+    return None if dtype is None else dtype.str
+
+
+def atomicPickle(obj, filename):
+    """Pickle 'obj' to 'filename' so that the file is either the old or the
+    new version, never a partly written one."""
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as outfile:
+        pickle.dump(obj, outfile, pickle.HIGHEST_PROTOCOL)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.rename(temp_filename, filename)
@@ -5,9 +5,13 @@
 
 import sys
 import time
-import pymssql
+import calendar
+import datetime as dt
+import numpy as np
 import subprocess
 
+from param import DATE_FORMAT
+
 # Get the max volume from the microphone
 # sample_time is in seconds
 def get_sound(sample_time=1):
@@ -33,14 +37,20 @@ def get_data(z_server):
     data_list = []
     data_list.append(int(time.time()))
     ## get data from sensors ##
+    # the server is checked once per poll (with the first device's
+    # attempts), not once per device
+    checked = False
     for (device_id) in z_server.list_device_ids():
         # If the server does not respond after ten attempts respond, exit
         for x in xrange(10):
             try:
-                data_dict = z_server.get_data(device_id)
-                x = 10
+                if not checked:
+                    z_server.check_connection()
+                    checked = True
+                data_dict = z_server.get_data(device_id, check_connection=False)
+                break
             except Exception:
-                if x == 10:
+                if x == 9:
                     print "Server connection lost. Closing down."
                     raise Exception
                 else:
@@ -56,53 +66,155 @@ def get_data(z_server):
 # Get power data from power database
 def get_power(config_info):
     """Connects to the MS SQL database and retrieves the value to be used as
-    total power consumption for the home
+    total power consumption for the home. The connection is kept open and
+    reused on the next call (see PowerSource)
     """
-    user = config_info["database"]["credentials"]["username"]
-    password = config_info["database"]["credentials"]["password"]
-    host = config_info["database"]["credentials"]["host"]
-    port = config_info["database"]["credentials"]["port"]
-    database = config_info["database"]["credentials"]["database_name"]
-
-    host = host + " " + port
-
-    # Connect to database
-    while True:
-        try:
-            cnx = pymssql.connect(server=host,
-                                  user=user,
-                                  password=password,
-                                  database=database)
-            break
-
-        except Exception:
-            print "Could not connect to power database."
-            time.sleep(1)
-
-    cursor = cnx.cursor()
-
-    # Query the database
-    Avg_over = 4
-    qry_base = "SELECT TOP " + str(Avg_over)
-
-    for data_column in config_info["database"]["table"]["data_columns"]:
-        qry_base += "[" + data_column + "],"
-
-    # strip off last comma
-    qry_base = qry_base[:-1]
-
-    qry = (qry_base + " FROM "
-           + "[" + database + "].[dbo].["
-           + config_info["database"]["table"]["name"] + "]"
-           + " ORDER BY [") + (config_info["database"]["table"]["time_column"] + "] DESC")
-    cursor.execute(qry)
-    # Aggregate power to a single number
-    # TODO, aggregate the power values in some way
-    final_power = 0
-    for row in cursor:
-        # this is where the value are, index the row returned
-        # like row[0] for first data column, row[1] for second
-        # data column, etc.
-       final_power = final_power + max(row[0],0) + max(row[1],0) # + 4.068189 #offset shark_1 to zero
-    cnx.close()
-    return final_power/Avg_over
+    global _power_source
+    if _power_source is None or _power_source.config_info is not config_info:
+        _power_source = PowerSource(config_info)
+    return _power_source.get_power()
+
+_power_source = None
+
+# DB-API errors caused by the query itself (bad table or column name,
+# missing permissions), which reconnecting cannot fix
+QUERY_ERRORS = ('ProgrammingError', 'DataError', 'IntegrityError', 'NotSupportedError')
+
+
+class PowerSource(object):
+    """Keeps one connection to the power database alive across ticks and
+    reconnects with exponential backoff when it is lost. The SQL is built
+    once, when the object is created. A query that still fails after
+    'max_attempts' tries, or fails with one of QUERY_ERRORS, is raised.
+
+    'connect' is a function returning a new DB-API connection; by default
+    it connects to the MS SQL server given in config_info (pymssql is only
+    imported then). 'dialect' is either 'mssql' or 'sqlite', so that a
+    local SQLite database with the same table can stand in for the server.
+    'sleep' is called with the number of seconds to wait between attempts.
+    """
+
+    def __init__(self, config_info, connect=None, dialect='mssql', max_backoff=60,
+                 max_attempts=5, sleep=time.sleep):
+        self.config_info = config_info
+        credentials = config_info["database"]["credentials"]
+        table = config_info["database"]["table"]
+        database = credentials["database_name"]
+
+        if connect is None:
+            host = credentials["host"] + " " + credentials["port"]
+            def connect():
+                import pymssql
+                return pymssql.connect(server=host,
+                                       user=credentials["username"],
+                                       password=credentials["password"],
+                                       database=database)
+        self.connect = connect
+        self.sleep = sleep
+        self.connection = None
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+
+        # Prepare the queries
+        self.Avg_over = 4
+        columns = ",".join("[" + column + "]" for column in table["data_columns"])
+        time_column = "[" + table["time_column"] + "]"
+        if dialect == 'mssql':
+            table_name = "[" + database + "].[dbo].[" + table["name"] + "]"
+            param = "%s"
+            self.latest_query = ("SELECT TOP " + str(self.Avg_over) + columns
+                                 + " FROM " + table_name
+                                 + " ORDER BY " + time_column + " DESC")
+        elif dialect == 'sqlite':
+            table_name = "[" + table["name"] + "]"
+            param = "?"
+            self.latest_query = ("SELECT " + columns
+                                 + " FROM " + table_name
+                                 + " ORDER BY " + time_column + " DESC"
+                                 + " LIMIT " + str(self.Avg_over))
+        else:
+            raise ValueError("unknown dialect %r" % dialect)
+
+        self.range_query = ("SELECT " + time_column + "," + columns
+                            + " FROM " + table_name
+                            + " WHERE " + time_column + " >= " + param
+                            + " AND " + time_column + " < " + param
+                            + " ORDER BY " + time_column)
+
+    def _execute(self, query, params=()):
+        """Run a query and return all rows, (re)connecting as needed."""
+        backoff = 1
+        attempts = 0
+        while True:
+            if self.connection is None:
+                try:
+                    self.connection = self.connect()
+                except Exception:
+                    print "Could not connect to power database."
+                    self.sleep(backoff)
+                    backoff = min(2*backoff, self.max_backoff)
+                    continue
+            try:
+                cursor = self.connection.cursor()
+                cursor.execute(query, params)
+                return cursor.fetchall()
+            except Exception as error:
+                attempts += 1
+                if type(error).__name__ in QUERY_ERRORS or attempts >= self.max_attempts:
+                    raise
+                self.close()
+                print "Power database query failed (%s), reconnecting." % error
+                self.sleep(backoff)
+                backoff = min(2*backoff, self.max_backoff)
+
+    def close(self):
+        """Close the database connection, if open."""
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def get_power(self):
+        """Return the average of the most recent power readings."""
+        # Aggregate power to a single number
+        # TODO, aggregate the power values in some way
+        final_power = 0
+        for row in self._execute(self.latest_query):
+            # this is where the value are, one per data column
+            final_power = final_power + sum(max(value, 0) for value in row)
+        return final_power/self.Avg_over
+
+    def get_power_range(self, start, end, granularity=60):
+        """Fetch all power readings between the datetimes 'start' and 'end'
+        in a single query, e.g. to backfill a training window.
+
+        Returns (times, power) as numpy arrays with one entry per interval
+        of 'granularity' seconds: the UTC timestamp of the start of the
+        interval and the average power of the readings in it (NaN where
+        there were none).
+        """
+        rows = self._execute(self.range_query, (start, end))
+        t0 = _timestamp(start)
+        num_buckets = int(np.ceil((_timestamp(end) - t0) / float(granularity)))
+        times = t0 + granularity * np.arange(num_buckets)
+        if len(rows) == 0:
+            return times, np.ones(num_buckets) * np.nan
+
+        row_times = np.array([_timestamp(row[0]) for row in rows])
+        power = np.array([sum(max(value, 0) for value in row[1:]) for row in rows], dtype=float)
+        buckets = ((row_times - t0) // granularity).astype(int)
+        totals = np.bincount(buckets, weights=power, minlength=num_buckets)
+        counts = np.bincount(buckets, minlength=num_buckets)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return times, totals[:num_buckets] / counts[:num_buckets]
+
+
+def _timestamp(value):
+    """Convert a datetime, date string or number to a UTC timestamp."""
+    if isinstance(value, basestring):
+        value = dt.datetime.strptime(value[:19], DATE_FORMAT)
+    if isinstance(value, dt.datetime):
+        return calendar.timegm(value.utctimetuple())
+    return float(value)
@@ -7,7 +7,8 @@
 """
 Shows visualizations of live incoming analysis results from pi_seq_BLR.py
 
-This program graphs CSV files with the following format:
+This program graphs the binary results store (RESULTS_STORE_FILE, see
+results.py) if there is one, and otherwise CSV files with the following format:
 
 Timestamp,Target,Prediction,Anomaly
 <timestamp>, <target>, <prediction>, <anomaly>
@@ -28,7 +29,6 @@ Example:
 #==================== LIBRARIES ====================#
 import os
 import sys
-import csv
 import time
 import datetime as dt
 import numpy as np
@@ -40,12 +40,20 @@ from matplotlib.backends.backend_qt4agg import (
     FigureCanvasQTAgg as FigureCanvas,
     NavigationToolbar2QT as NavigationToolbar)
 from matplotlib import pyplot as plt
-from matplotlib.dates import DateFormatter
+from matplotlib.dates import DateFormatter, epoch2num
 from matplotlib.ticker import LinearLocator
 from matplotlib.figure import Figure
+from matplotlib.collections import PolyCollection
+from matplotlib.transforms import blended_transform_factory
+from dateutil.tz import tzlocal
 
 from param import *
 from algoFunctions import movingAverage
+from results import ResultsTail, ResultsBuffer, readStore
+
+
+#==================== PARAMETERS ====================#
+MAX_PAST_HOURS = 24     # Longest time window that can be shown
 
 
 #==================== HELPER CLASSES ====================#
@@ -76,6 +84,51 @@ class Settings(OrderedDict):
                 outfile.write(line)
 
 
+#==================== HELPER FUNCTIONS ====================#
+def decimate(x, y, num_bins):
+    """
+    Reduce the line (x, y) to the minimum and maximum point of each of
+    'num_bins' equal groups of points, in their original order. The
+    decimated line looks the same when drawn 'num_bins' pixels wide.
+    Lines with at most two points per bin are returned as they are.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= 2 * num_bins:
+        return x, y
+
+    # Pad the last group with its final value so the groups can be reshaped
+    size = -(-n // num_bins)
+    groups = np.empty(size * num_bins)
+    groups[:n] = y
+    groups[n:] = y[-1]
+    groups = groups.reshape(num_bins, size)
+
+    offsets = np.arange(num_bins) * size
+    index = np.concatenate((offsets + np.argmin(groups, axis=1),
+                            offsets + np.argmax(groups, axis=1)))
+    index = np.unique(np.minimum(index, n - 1))
+    return x[index], y[index]
+
+
+def fitLimits(limits, low, high, margins):
+    """
+    Return new axis limits for data between 'low' and 'high', or None if
+    the current 'limits' still fit it well. 'margins' are the fractions of
+    the data range to leave free below and above (room for the data to grow
+    without rescaling). Limits are also renewed once they are more than
+    twice as wide as needed, e.g. after showing a shorter time window.
+    """
+    size = high - low
+    if size <= 0:
+        size = max(abs(high), 1e-3)
+    if (limits[0] <= low and high <= limits[1] and
+            limits[1] - limits[0] <= 2 * size):
+        return None
+    return (low - margins[0] * size, high + margins[1] * size)
+
+
 #==================== GUI CLASSES ====================#
 class ResultsGraph(FigureCanvas):
 
@@ -93,16 +146,23 @@ class ResultsGraph(FigureCanvas):
         zero = dt.datetime.fromtimestamp(0)
         one = dt.datetime.fromtimestamp(1)
         x, y = [zero, one], [-1, -1]
-        self.predict_line, = self.graph_power.plot(x, y, color='0.8')
-        self.target_line, = self.graph_power.plot(x, y, color='r', linestyle='--')
-        self.error_line, = self.graph_error.plot(x, y, color='r')
-        self.color_spans = []
+        self.predict_line, = self.graph_power.plot(x, y, color='0.8', animated=True)
+        self.target_line, = self.graph_power.plot(x, y, color='r', linestyle='--', animated=True)
+        self.error_line, = self.graph_error.plot(x, y, color='r', animated=True)
+        self.lines = [self.predict_line, self.target_line, self.error_line]
+        self.color_spans = None
+        self.spans = ((), (), ())   # (starts, ends, colors) of color_spans
+
+        # The lines are animated: a full draw renders everything else and
+        # saves it as the background, then line updates are blitted on top
+        self.background = None
+        self.mpl_connect('draw_event', self.onDraw)
 
         # Change settings of graph
         self.graph_power.set_ylabel("Power (kW)")
         self.graph_error.set_ylabel("Error (kW)")
-        self.graph_power.xaxis.set_major_formatter(DateFormatter("%Y-%m-%d %H:%M:%S"))
-        self.graph_error.xaxis.set_major_formatter(DateFormatter("%Y-%m-%d %H:%M:%S"))
+        self.graph_power.xaxis.set_major_formatter(DateFormatter("%Y-%m-%d %H:%M:%S", tz=tzlocal()))
+        self.graph_error.xaxis.set_major_formatter(DateFormatter("%Y-%m-%d %H:%M:%S", tz=tzlocal()))
         self.graph_power.xaxis.set_major_locator(LinearLocator(numticks=5))
         self.graph_error.xaxis.set_major_locator(LinearLocator(numticks=5))
 
@@ -121,52 +181,104 @@ class ResultsGraph(FigureCanvas):
         self.fig.tight_layout()
         self.draw()
 
-    def graphData(self, times, target, predict):
-        """ Update the graph using the given data."""
+    def graphData(self, times, target, predict, redraw=True):
+        """ Update the graph using the given data.
+        'times' are timestamps in seconds since the epoch."""
         assert(len(times) == len(target))
         assert(len(times) == len(predict))
 
-        # Convert to kW and generate error line
-        target = [i/1000.0 for i in target]
-        predict = [i/1000.0 for i in predict]
-        error = [predict[i] - target[i] for i in xrange(len(times))]
-
-        # Determine new bounds of graph
-        xmin = min(times)
-        xmax = max(times)
-        ymin = 0
-        ymax = max(max(target), max(predict)) * 1.1
-        emin = min(min(error) * 1.1, 0)
-        emax = max(max(error) * 1.1, 0)
-        self.graph_power.set_xlim(xmin, xmax)
-        self.graph_power.set_ylim(ymin, ymax)
-        self.graph_error.set_xlim(xmin, xmax)
-        self.graph_error.set_ylim(emin, emax)
-
-        # Set data to lines and re-draw graph
-        self.predict_line.set_data(times, predict)
-        self.target_line.set_data(times, target)
-        self.error_line.set_data(times, error)
-        self.fig.tight_layout()
-        self.draw()
+        # Only about two points per pixel column can be seen, so the
+        # lines are decimated to the width of the graph before plotting
+        num_bins = max(1, int(self.graph_power.bbox.width))
+        times = epoch2num(np.asarray(times))
+        error = np.asarray(predict) - np.asarray(target)
+        target_times, target = decimate(times, target, num_bins)
+        predict_times, predict = decimate(times, predict, num_bins)
+        error_times, error = decimate(times, error, num_bins)
+
+        # Convert to kW
+        target = target / 1000.0
+        predict = predict / 1000.0
+        error = error / 1000.0
+
+        # Axes are only rescaled (with some room to grow) when the data
+        # no longer fits, otherwise the new lines are simply blitted
+        xlim = fitLimits(self.graph_power.get_xlim(), times[0], times[-1], (0, 0.1))
+        ylim = fitLimits(self.graph_power.get_ylim(),
+                         0, max(np.max(target), np.max(predict)), (0, 0.1))
+        elim = fitLimits(self.graph_error.get_ylim(),
+                         min(np.min(error), 0), max(np.max(error), 0), (0.1, 0.1))
+        if xlim is not None:
+            self.graph_power.set_xlim(xlim)
+            self.graph_error.set_xlim(xlim)
+        if ylim is not None:
+            self.graph_power.set_ylim(ylim)
+        if elim is not None:
+            self.graph_error.set_ylim(elim)
+        if (xlim, ylim, elim) != (None, None, None):
+            self.background = None
+
+        self.predict_line.set_data(predict_times, predict)
+        self.target_line.set_data(target_times, target)
+        self.error_line.set_data(error_times, error)
+        if redraw:
+            self.refresh()
+
+    def setSpans(self, starts, ends, colors, redraw=True):
+        """Replace the vertical color spans on the graph. Span i goes from
+        timestamp starts[i] to ends[i] and has color colors[i]. If the spans
+        did not change, the background can still be blitted."""
+        spans = (tuple(np.asarray(starts, dtype=float)),
+                 tuple(np.asarray(ends, dtype=float)),
+                 tuple(colors))
+        if spans == self.spans:
+            if redraw:
+                self.refresh()
+            return
+        self.spans = spans
+        if self.color_spans is not None:
+            self.color_spans.remove()
+            self.color_spans = None
+
+        # All spans are a single collection of rectangles, with x in
+        # data coordinates and y covering the whole height of the axes
+        if len(starts) > 0:
+            starts = epoch2num(np.asarray(starts, dtype=float))
+            ends = epoch2num(np.asarray(ends, dtype=float))
+            verts = np.empty([len(starts), 4, 2])
+            verts[:, :, 0] = np.column_stack((starts, starts, ends, ends))
+            verts[:, :, 1] = [0, 1, 1, 0]
+            self.color_spans = PolyCollection(
+                verts, facecolors=colors, edgecolors='none', alpha=0.2,
+                transform=blended_transform_factory(self.graph_power.transData,
+                                                    self.graph_power.transAxes))
+            self.graph_power.add_collection(self.color_spans, autolim=False)
+        self.background = None
+        if redraw:
+            self.refresh()
+
+    def refresh(self):
+        """Show the current lines, redrawing the whole figure only if needed."""
+        if self.background is None:
+            self.draw()
+        else:
+            self.restore_region(self.background)
+            self.drawLines()
+            self.blit(self.fig.bbox)
 
-    def colorSpans(self, spans):
-        """Add a series of vertical color spans to the graph."""
-        for span in spans:
-            start = span[0]
-            end = start + dt.timedelta(minutes=span[1])
-            span = self.graph_power.axvspan(xmin=start, xmax=end, color=span[2], alpha=0.2)
-            self.color_spans.append(span)
-        self.fig.tight_layout()
-        self.draw()
+    def drawLines(self):
+        for line in self.lines:
+            line.axes.draw_artist(line)
 
-    def clearSpans(self):
-        """Remove all vertical color spans."""
-        for span in self.color_spans:
-            span.remove()
-        self.color_spans = []
+    def onDraw(self, event):
+        """After a full draw, save the background and draw the lines on it."""
+        self.background = self.copy_from_bbox(self.fig.bbox)
+        self.drawLines()
+
+    def resizeEvent(self, event):
+        """Lay out the figure again only when the window size changes."""
         self.fig.tight_layout()
-        self.draw()
+        FigureCanvas.resizeEvent(self, event)
 
 
 class ResultsWindow(QtGui.QMainWindow):
@@ -181,6 +293,16 @@ class ResultsWindow(QtGui.QMainWindow):
         self.setWindowIcon(QtGui.QIcon(ICON_FILE))
         self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
 
+        # Results are read incrementally (see results.py), preferably
+        # straight from the memory-mapped binary store
+        if os.path.exists(RESULTS_STORE_FILE):
+            self.results_file = RESULTS_STORE_FILE
+        else:
+            self.results_file = RESULTS_FILE
+        self.results_tail = None
+        self.results = ResultsBuffer(MAX_PAST_HOURS * 60)
+        self.times = self.targets = self.predictions = self.anomalies = np.zeros(0)
+
         # Create top-level widget and immediate children
         self.statusBar()
         main_widget = QtGui.QWidget()
@@ -243,7 +365,7 @@ class ResultsWindow(QtGui.QMainWindow):
         layout.addRow(self.pause_button)
         
         self.update_button = QtGui.QPushButton("Update Now", main_widget)
-        self.update_button.clicked.connect(lambda: self.loadFile(RESULTS_FILE))
+        self.update_button.clicked.connect(lambda: self.loadFile(self.results_file))
         layout.addRow(self.update_button)
         
         self.update_countdown = QtGui.QLabel("Time until next update: %d seconds" % 0)
@@ -266,7 +388,7 @@ class ResultsWindow(QtGui.QMainWindow):
 
         past_label = QtGui.QLabel("Past results to show (hours):   ")
         self.past_edit = QtGui.QSpinBox(main_widget)
-        self.past_edit.setRange(1, 24)
+        self.past_edit.setRange(1, MAX_PAST_HOURS)
         layout.addRow(past_label, self.past_edit)
 
         self.smooth_box = QtGui.QCheckBox("Smooth data (window in minutes):    ", main_widget)
@@ -292,33 +414,37 @@ class ResultsWindow(QtGui.QMainWindow):
     # others are helper functions which perform a simple task.
 
     def loadFile(self, filename):
-        """Load in the data from the results file."""
-        
-        try:
-            file = open(filename, 'rb')
-        except IOError as error:
-            print repr(error)
+        """Load the rows added to the results file since the last call."""
+
+        if not os.path.exists(filename):
+            print "Results file not found:", filename
             sys.exit(1)
 
-        reader = csv.reader(file)
-        headers = reader.next()
-        columns = zip(*reader)
-        file.close()
-
-        # Convert times from string or timestamp to datetime
-        try:
-            self.times = [
-                dt.datetime.fromtimestamp(float(t)) for t in columns[0]]
-        except ValueError:
-            self.times = [
-                dt.datetime.strptime(t, DATE_FORMAT) for t in columns[0]]
-        
-        self.targets = [float(t) for t in columns[1]]
-        self.predictions = [float(t) for t in columns[2]]
-        if len(columns) >= 4:
-            self.anomalies = [float(t) for t in columns[3]]
-        else:
-            self.anomalies = []
+        # Binary store: map the most recent records, nothing to parse
+        if filename.endswith('.bin'):
+            records = readStore(filename, last=self.results.capacity)
+            self.times = records['time']
+            self.targets = records['target']
+            self.predictions = records['prediction']
+            self.anomalies = records['anomaly']
+            self.updateGraph()
+            return
+
+        # Only the newly appended rows are parsed; the whole file is
+        # read again only if it was replaced (compacted) in the meantime
+        if self.results_tail is None or self.results_tail.filename != filename:
+            self.results_tail = ResultsTail(filename)
+            self.results.clear()
+        rows, reset = self.results_tail.read()
+        if reset:
+            self.results.clear()
+        self.results.extend(rows)
+        self.times = self.results.times
+        self.targets = self.results.targets
+        self.predictions = self.results.predictions
+        self.anomalies = self.results.anomalies
+
+        if not self.results.has_anomalies:
             self.anomaly_box.setChecked(False)
             self.anomaly_box.setDisabled(True)
             self.anomaly_edit.setDisabled(True)
@@ -385,6 +511,9 @@ class ResultsWindow(QtGui.QMainWindow):
     def updateGraph(self):
         """Graph the pre-loaded data and add any desired features."""
 
+        if len(self.times) == 0:
+            return
+
         # Step 1: Show only past X hours
         time_window = int(self.settings['past']) * 60     # Convert to minutes
         times = self.times[-time_window:]
@@ -399,39 +528,44 @@ class ResultsWindow(QtGui.QMainWindow):
             targets = movingAverage(targets, smoothing_window)
             predictions = movingAverage(predictions, smoothing_window)
 
-        self.canvas.graphData(times, targets, predictions)
-        
         # Step 3: Anomalies
         if self.settings['anomaly_check'] == 'True':
             self.showAnomalies(times, anomalies)
         else:
-            self.canvas.clearSpans()
+            self.canvas.setSpans([], [], [], redraw=False)
+
+        # Step 4: Draw everything at once
+        self.canvas.graphData(times, targets, predictions)
 
     def showAnomalies(self, times, anomalies):
         """Draw colored bars to show regions where anomalies happened."""
         self.options_widget.setDisabled(True)
-        self.canvas.clearSpans() #Clear any existing spans
-        start = 0
         dur = int(self.settings['anomaly'])
         level1 = 0
         level2 = dur / 3.0
         level3 = level2 * 2
-        spans = []  # List of color spans
-
-        while start < len(times):
-            #Count number of anomalies and choose a corresponding color
-            start_time = times[start]
-            count = sum(anomalies[start:(start + dur)])
-            if count > 0:
-                if count > level3:
-                    spans.append((start_time, dur, 'red'))
-                elif count > level2:
-                    spans.append((start_time, dur, 'orange'))
-                else:
-                    spans.append((start_time, dur, 'green'))
-            start += dur
-
-        self.canvas.colorSpans(spans)
+        colors = np.array([None, 'green', 'orange', 'red'])
+
+        # Count the anomalies in each window of 'dur' minutes and choose
+        # a corresponding color (0 = no anomalies, no span). The windows
+        # are aligned to absolute time, so they stay put as the graph
+        # scrolls and unchanged spans are not redrawn
+        dur_seconds = dur * 60
+        buckets = np.asarray(times, dtype=float) // dur_seconds
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        counts = np.add.reduceat(np.asarray(anomalies, dtype=float), starts)
+        levels = (counts > level1).astype(int) + (counts > level2) + (counts > level3)
+
+        # Merge neighbouring windows of the same color into one span
+        changes = np.flatnonzero(np.diff(levels)) + 1
+        first = np.concatenate(([0], changes))
+        last = np.concatenate((changes, [len(levels)])) - 1
+        shown = levels[first] > 0
+        first, last = first[shown], last[shown]
+
+        span_starts = buckets[starts[first]] * dur_seconds
+        span_ends = (buckets[starts[last]] + 1) * dur_seconds
+        self.canvas.setSpans(span_starts, span_ends, list(colors[levels[first]]), redraw=False)
         self.options_widget.setEnabled(True)
 
     def initTimer(self):
@@ -444,7 +578,7 @@ class ResultsWindow(QtGui.QMainWindow):
         """Decrement the counter and update if necessary the graph."""
         if not self.paused:
             if self.timeout == 0:
-                self.loadFile(RESULTS_FILE)
+                self.loadFile(self.results_file)
                 self.timeout = float(self.settings['update'])
             else:
                 self.timeout -= 1
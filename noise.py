@@ -1,14 +1,15 @@
-import subprocess
+import time
+from sound import SoundLevel
 
-sample_time = 1
+# Print the sound levels of the microphone once per second
+sound = SoundLevel(device="plughw:0,0")
 
 while True:
 
-    command = "/usr/bin/arecord -D plughw:0,0 -d " + str(sample_time) + " -f S16_LE | /usr/bin/sox -t .wav - -n stat"
-
-    p = subprocess.Popen(command, bufsize=1, shell=True,  stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-
-    for line in p.stdout:
-        if "Maximum amplitude" in line:
-            print "Max:", line.split()[-1]
+    time.sleep(1)
 
+    try:
+        max_level, rms_level = sound.levels()
+        print "Max:", max_level, "RMS:", rms_level
+    except IOError:
+        print "No audio yet"
@@ -15,6 +15,7 @@ ICON_FILE = 'app/merit_icon.png'
 SETTINGS_FILE = 'app/settings.txt'
 
 RESULTS_FILE = 'results.csv'
+RESULTS_STORE_FILE = 'results.bin'
 BACKUP_FILE = 'xbackup.bak'
 #LOG_FILE = '/var/log/sequential_predictions.log'
 LOG_FILE = './sequential_predictions.log'
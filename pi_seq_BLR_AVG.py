@@ -43,16 +43,19 @@ sound_on = arg.sound
 
 print "Initializing libraries..."
 
-import time
 import datetime as dt
 import numpy as np
 import json
 import logging
-import pickle 
 
 from param import *
-from algoFunctions import train, runnable, severityMetric, writeResults
+from algoFunctions import train, severityMetric, coverage, expandModel
+from results import ResultsLog, ResultsStore
+from preprocess import Preprocessor
+from smoothing import Smoother, fromSettings
+from checkpoint import Checkpoint
 from get_data import get_data, get_power
+from pipeline import Pipeline
 from zwave_api import ZWave
 
 
@@ -67,8 +70,7 @@ np.set_printoptions(precision=3, linewidth=200)
 
 
 ##### PARAMETERS #####
-XLOG_FILENAME = "X_DATA.bak"
-Xog_LOG_FILENAME = "Xog_DATA.bak"
+CHECKPOINT_FILENAME = "X_CHECKPOINT.bak"
 SECS_PER_MIN = 60
 MINS_PER_HOUR = 60
 HOURS_PER_DAT = 24
@@ -91,15 +93,6 @@ ZServer = ZWave(config_dict["z_way_server"]["host"],
                 device_dict)
 ZServer_devices = ZServer.list_devices()
 print ZServer_devices
-# Load the previous training window
-logged_Xdata = np.zeros([1, 1])
-logged_Xog = np.zeros([1,1])
-try:
-    logged_Xdata = pickle.load(open(XLOG_FILENAME, "r"))
-    logged_Xog = pickle.load(open(Xog_LOG_FILENAME,"r"))
-    print "Training backup file found..."
-except IOError:
-    print "***WARNING: No training backup found.***"
 
 
 ############################################################
@@ -110,6 +103,7 @@ except IOError:
 w_opt = []
 a_opt = 0
 b_opt = 0
+S_N = 0
 mu = 0
 sigma = 1000
 w, L = (.84, 3.719) # EWMA parameters. Other pairs can also be used, see paper
@@ -132,96 +126,108 @@ granularity_in_seconds = int(train_p[0])*60
 logging.info("Starting program with settings: {} {} {} sound:{}".format(train_p[0], train_p[1], train_p[2],arg.sound))
 
 # X is the matrix containing the training data
-Avg_over = 5
 X = np.zeros([matrix_length, num_sensors+1]) #sensors, energy reading
-X_og = np.zeros([Avg_over,num_sensors+1])
-# Use the previous X matrix to save time, if available 
-# Make sure logged_Xdata is the proper size
-if np.shape(logged_Xdata) == (matrix_length, num_sensors+1) and np.shape(logged_Xog) == (Avg_over, num_sensors+1):
-    print "sizes: logged, mat, num", np.shape(logged_Xdata), matrix_length, num_sensors+1
-    X = logged_Xdata
-    X_og = logged_Xog
-    init_training = True
-else:
-    print "Unable to use training backup. Continuing analysis without backup..."
-
-y = [None]*matrix_length
-
-# Keep track of number of times the same data has been repeated
-# TODO: Add logic to not use data if it is repeated too many times
-#       This is caused by sensors that have been turned off but report the same data
-last_data = [0]*num_sensors         # Last data
-last_data_count = [0]*num_sensors   # Number of polls since change of data
-last_data_threshold = 10            # Max number of polls to tolerate
-
-############################################################
 
-print "Starting analysis..."
+# Sensor data smoothing is selected in config.json with the same keys as
+# in the settings of sequentialDriver (see smoothing.fromSettings). By
+# default the current and the last 5 readings are averaged
+smoothing_settings = {"smoothing": "boxcar", "smoothing_window": 6}
+smoothing_settings.update(config_dict)
+smoother = Smoother(num_sensors, *fromSettings(smoothing_settings))
 
 row_count = 0
 
-y_time = []
-y_target = []
-y_predict = []
-anomaly = []
-
-# Prepare the timer
-goal_time = time.time()
-#goal_time = goal_time - (goal_time % 60)
+# Continue from the last checkpoint, if available: the training window,
+# the model, the severity and the smoothing state (see checkpoint.py)
+checkpoint = Checkpoint(CHECKPOINT_FILENAME, num_sensors+1, matrix_length)
+try:
+    state, indices, rows = checkpoint.load()
+    if (state['num_sensors'], state['matrix_length']) != (num_sensors, matrix_length):
+        raise ValueError("training backup not properly sized")
+    smoother.restore(state['smoothing'])
+    X[indices % matrix_length] = rows
+    row_count = state['row_count']
+    w_opt = state['w_opt']
+    a_opt = state['a_opt']
+    b_opt = state['b_opt']
+    S_N = state['S_N']
+    mu = state['mu']
+    sigma = state['sigma']
+    Sn_1 = state['Sn_1']
+    alert_counter = state['alert_counter']
+    init_training = state['init_training']
+    print "Training backup found, continuing from row", row_count
+except IOError:
+    print "***WARNING: No training backup found.***"
+    checkpoint.create()
+except ValueError as error:
+    print "Unable to use training backup (%s). Continuing analysis without backup..." % error
+    checkpoint.create()
+
+# Missing sensor data is replaced by the last good value for a while.
+# Sensors that stay missing are marked invalid (-1) instead. Repeated
+# values are not treated as stuck: door and motion sensors legitimately
+# read 0 for hours
+last_data_threshold = 10            # Max number of polls to tolerate
+preprocessor = Preprocessor(num_sensors, stale_limit=last_data_threshold,
+                            repeat_limit=0)
 
-while True:
+# Sensors with less valid data than this in the training window are
+# left out of training (as in Algo.train)
+min_feature_coverage = 0.5
 
-    # Wake up periodically to check time
-    while goal_time > time.time():
-        time.sleep(0.1)
+############################################################
 
-    # Record the time of the next iteration
-    cur_time = goal_time
-    goal_time += granularity_in_seconds
+print "Starting analysis..."
 
-    #if __debug__:
-    print "\nTrying time", dt.datetime.now().strftime(DATE_FORMAT)
+# Results are appended; the log keeps at least the last matrix_length rows
+results_log = ResultsLog(RESULTS_FILE, matrix_length)
+results_store = ResultsStore(RESULTS_STORE_FILE)
 
-    # Retrieve sensor data from ZServer
+# Data collection: the sensors and the power database are read at the
+# same time on every tick (see pipeline.py)
+def read_sensors():
+    # get_data retries on its own; if it gives up, end the analysis
     try:
         new_data = get_data(ZServer)
     except Exception:
         print "KILLED"
         logging.error("ZServer Connection Lost. Ending analysis.")
-        exit(1)
-        logging.error("Exit(1) failed to end program.")
-        print "exit failed"
+        pipe.stop()
+        raise
+    print "ZServer connections:", ZServer.connection_stats()
+    # new_data[0] is a timestamp we don't need, the rest are sensor readings
+    return new_data[1:]
+
+def read_power():
+    return float(get_power(config_dict))
+
+# Data analysis, one row (sensor readings, power) per tick
+def analyze(cur_time, row):
+    global X, w_opt, a_opt, b_opt, S_N, mu, sigma, Sn_1, alert_counter
+    global init_training, row_count
+
+    #if __debug__:
+    print "\nTrying time", dt.datetime.fromtimestamp(cur_time).strftime(DATE_FORMAT)
+
+    # A row without a power reading has no target to train on or predict
+    T_Power = row[num_sensors]
+    if np.isnan(T_Power):
+        print "No power reading, row skipped"
+        return None
+
+    new_data = preprocessor.process(row[:num_sensors])
+    print "Staleness:", preprocessor.staleness()
 
-    #get current energy reading
+    #Update X with the sensor data and the current energy reading
+    # Invalid readings (-1) are passed on as they are, not averaged
     cur_row = (row_count) % matrix_length
-    og_row = row_count % Avg_over
-    T_Power =  float(get_power(config_dict))
-    X[cur_row][num_sensors] = T_Power
-    X_og[og_row][num_sensors] = T_Power
-    
-    #Update X - new_data[0] contains a timestamp we don't need
-    for i in range(1, num_sensors + 1):
-        #We have new valid data! Also update last_data
-        print "{}: {}".format(ZServer_devices[i-1], new_data[i], len(new_data), i, num_sensors)
-
-        if row_count > 4:
-           Avg_last_mat = X_og[0:,i-1]
-           sum_last_5 = sum(Avg_last_mat)
-           Avg_last_5 = (sum_last_5 + new_data[i])/6 #5 pervious points plus current point = 6
-           X[cur_row][i-1] = Avg_last_5
-        else:        
-            X[cur_row][i-1] = new_data[i]
- 
-        X_og[og_row][i-1] = new_data[i]
-
-        '''
-        if new_data[i] == last_data[i-1]:
-            last_data_count[i-1] += 1
-        else:
-            last_data[i-1] = new_data[i]
-            last_data_count[i-1] = 0
-        '''
-    print "X_og: \n",X_og
+    for i in range(num_sensors):
+        print "{}: {}".format(ZServer_devices[i], new_data[i])
+    new_row = np.append(smoother.smooth(new_data), T_Power)
+    checkpoint.append(row_count, new_row)
+    X[cur_row] = new_row
+
     print "X: \n",X[cur_row]
     
     # Train the model
@@ -234,17 +240,19 @@ while True:
         y = X[cur_row:, num_sensors]
         y = np.concatenate((y, X[:cur_row, num_sensors]), axis=0)
 
-        # BLR train:
-        w_opt, a_opt, b_opt, S_N = train(data, y)
+        # BLR train, leaving out sensors without enough valid data; they
+        # get zero weight so their invalid readings do not affect predictions
+        overall, per_feature = coverage(data)
+        features = per_feature >= min_feature_coverage
+        if np.any(features) and (init_training or overall > 0.5):
+            w_opt, a_opt, b_opt, S_N = train(data[:, features], y)
+            w_opt, S_N = expandModel(features, w_opt, S_N)
+            init_training = True
+            if not np.all(features):
+                print "Excluded sensors:", [ZServer_devices[i] for i in np.flatnonzero(~features)]
 
-        init_training = True
+    result = None
 
-        # Log current training windows as pickle files
-        with open(XLOG_FILENAME, 'w') as logfile:
-            pickle.dump(X, logfile)
-        with open(Xog_LOG_FILENAME, 'w') as logfile:
-            pickle.dump(X_og, logfile)
-        
     # Make a prediction
     if init_training:
 
@@ -288,27 +296,46 @@ while True:
 
         Sn_1 = Sn
 
-        if anomaly_found:
-            anomaly.append(1)
-        else:
-            anomaly.append(0)
-        
-        y_target.append(target)
-        y_predict.append(prediction)
-        y_time.append(cur_time)
-
-        # Achieve scrolling effect by only writing most recent data
-        if len(y_time) >= matrix_length:
-            y_time = y_time[-matrix_length:]
-            y_target = y_target[-matrix_length:]
-            y_predict = y_predict[-matrix_length:]
-            anomaly = anomaly[-matrix_length:]
-
-        writeResults(RESULTS_FILE, (y_time, y_target, y_predict, anomaly))
-
         print "Target:", target, 
         print "Prediction:", prediction
         if (actual_prediction < 0):
             print "Actual Predict:", actual_prediction
 
+        result = (cur_time, target, prediction, anomaly_found)
+
     row_count += 1
+
+    # Save the state after every row, including this row's severity
+    checkpoint.save({
+        'num_sensors': num_sensors,
+        'matrix_length': matrix_length,
+        'row_count': row_count,
+        'w_opt': w_opt,
+        'a_opt': a_opt,
+        'b_opt': b_opt,
+        'S_N': S_N,
+        'mu': mu,
+        'sigma': sigma,
+        'Sn_1': Sn_1,
+        'alert_counter': alert_counter,
+        'init_training': init_training,
+        'smoothing': smoother.state(),
+    })
+    return result
+
+# Record results
+def output(result):
+    cur_time, target, prediction, anomaly_found = result
+    results_log.append((cur_time, target, prediction, int(anomaly_found)))
+    results_store.append(result)
+    print "Pipeline:", pipe.stats()
+
+pipe = Pipeline([('sensors', read_sensors, num_sensors), ('power', read_power, 1)],
+                analyze, output, granularity_in_seconds)
+pipe.run()
+
+# The pipeline only stops once the sensors are lost
+results_log.close()
+results_store.close()
+checkpoint.close()
+exit(1)
@@ -0,0 +1,243 @@
+# Filename:     pipeline.py
+# Author(s):    based on sequentialDriver.py by apadin
+# Start Date:   2026-10-17
+
+"""Staged, non-blocking acquisition pipeline for the driver loop.
+
+Every tick (once per granularity), all acquisition sources (sensor
+polling, power query, sound level, ...) are started at the same time
+on a thread pool. Their results are assembled into a single row and
+put on a bounded queue. A separate analysis thread takes completed
+rows from that queue and passes its results on to an output thread,
+so neither a slow training session nor a slow write delays the next
+acquisition.
+
+A source that has not answered by the time the next tick is due is
+abandoned for this tick and its values are filled with NaN (its
+width is taken from its last answer, or from the width declared for
+it). The pipeline keeps statistics
+of the latency of every stage and of late, missed and dropped ticks.
+
+Example:
+
+    pipe = Pipeline([('sensors', read_sensors, 12), ('power', read_power, 1)],
+                    analyze, write, granularity=60)
+    pipe.run()
+
+"""
+
+
+#==================== LIBRARIES ====================#
+import time
+import Queue
+import threading
+import numpy as np
+from collections import deque
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+
+#==================== CLASSES ====================#
+
+class StageTimer(object):
+    """Keeps the latencies of the most recent runs of a stage."""
+
+    def __init__(self, history=100):
+        self.count = 0
+        self.latencies = deque(maxlen=history)
+
+    def add(self, latency):
+        self.count += 1
+        self.latencies.append(latency)
+
+    def stats(self):
+        """Return a dictionary with the count, last, mean and max latency."""
+        latencies = list(self.latencies)
+        if not latencies:
+            return {'count': self.count}
+        return {'count': self.count,
+                'last': latencies[-1],
+                'mean': sum(latencies) / len(latencies),
+                'max': max(latencies)}
+
+
+class Pipeline(object):
+
+    def __init__(self, sources, analyze, output, granularity, queue_size=10, time_allign=False):
+        """
+        'sources' is a list of (name, function) or (name, function, width)
+        tuples. Each function takes no arguments and returns a value or a
+        list of values; the row passed to the analysis is the concatenation
+        of all source values, in order. With a declared width, a source that
+        fails or is late before its first answer is filled with that many
+        NaNs; otherwise the first answer has to be waited for.
+        'analyze(timestamp, row)' is run on the analysis thread and its result
+        (unless None) is passed to 'output(result)' on the output thread.
+        'granularity' is the time between ticks in seconds.
+        """
+        self.sources = [(source[0], source[1]) for source in sources]
+        self.analyze = analyze
+        self.output = output
+        self.granularity = granularity
+        self.time_allign = time_allign
+
+        self.pool = ThreadPool(len(self.sources))
+        self.pending = {}
+        self.analysis_queue = Queue.Queue(maxsize=queue_size)
+        self.output_queue = Queue.Queue(maxsize=queue_size)
+        self.widths = dict((source[0], source[2]) for source in sources if len(source) > 2)
+        self.running = False
+
+        # Statistics
+        self.lock = threading.Lock()
+        self.timers = dict((name, StageTimer()) for name, source in self.sources)
+        self.timers['acquisition'] = StageTimer()
+        self.timers['analysis'] = StageTimer()
+        self.timers['output'] = StageTimer()
+        self.ticks = 0
+        self.late_ticks = 0     # ticks where at least one source did not answer in time
+        self.missed_ticks = 0   # ticks skipped because the loop fell behind
+        self.dropped_rows = 0   # rows discarded because the analysis queue was full
+        self.errors = 0
+
+    def run(self, max_ticks=None):
+        """Start the analysis and output threads and run the tick loop."""
+        self.running = True
+        workers = [threading.Thread(target=self._analysisLoop),
+                   threading.Thread(target=self._outputLoop)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        goal_time = time.time()
+        if self.time_allign:
+            goal_time = goal_time + self.granularity - (goal_time % self.granularity)
+
+        try:
+            while self.running and (max_ticks is None or self.ticks < max_ticks):
+
+                # Wait for the next tick; skip ticks if we fell behind
+                while goal_time > time.time():
+                    time.sleep(min(0.1, max(0, goal_time - time.time())))
+                behind = int((time.time() - goal_time) // self.granularity)
+                if behind > 0:
+                    with self.lock:
+                        self.missed_ticks += behind
+                    goal_time += behind * self.granularity
+
+                tick_time = goal_time
+                goal_time += self.granularity
+                row = self._acquire(deadline=goal_time)
+
+                with self.lock:
+                    self.ticks += 1
+                try:
+                    self.analysis_queue.put_nowait((tick_time, row))
+                except Queue.Full:
+                    with self.lock:
+                        self.dropped_rows += 1
+        finally:
+            # Let the queued rows through, then stop the workers
+            self.analysis_queue.put(None)
+            for worker in workers:
+                worker.join()
+            self.running = False
+
+    def stop(self):
+        """Stop the tick loop after the current tick."""
+        self.running = False
+
+    def _acquire(self, deadline):
+        """Run all sources concurrently and return the assembled row."""
+        start_time = time.time()
+
+        # A source still busy from an earlier tick is not started again;
+        # its pending answer is used for this tick instead
+        for name, source in self.sources:
+            if name not in self.pending:
+                self.pending[name] = self.pool.apply_async(_timed, (source,))
+
+        row = []
+        late = False
+        for name, source in self.sources:
+            # Sources that never answered before have to be waited for,
+            # since the width of their data is not known yet
+            timeout = max(0, deadline - time.time()) if name in self.widths else None
+            job = self.pending[name]
+            try:
+                values, latency = job.get(timeout)
+                values = list(np.atleast_1d(values))
+                self.widths[name] = len(values)
+                with self.lock:
+                    self.timers[name].add(latency)
+            except TimeoutError:
+                late = True
+                values = [np.nan] * self.widths[name]
+            except Exception as error:
+                with self.lock:
+                    self.errors += 1
+                print "Source %s failed: %r" % (name, error)
+                late = True
+                values = [np.nan] * self.widths.get(name, 0)
+            if job.ready():
+                del self.pending[name]
+            row.extend(values)
+
+        with self.lock:
+            self.timers['acquisition'].add(time.time() - start_time)
+            if late:
+                self.late_ticks += 1
+        return np.array(row, dtype=float)
+
+    def _analysisLoop(self):
+        while True:
+            item = self.analysis_queue.get()
+            if item is None:
+                self.output_queue.put(None)
+                return
+            try:
+                result, latency = _timed(self.analyze, *item)
+                with self.lock:
+                    self.timers['analysis'].add(latency)
+            except Exception as error:
+                with self.lock:
+                    self.errors += 1
+                print "Analysis failed: %r" % error
+                continue
+            if result is not None:
+                self.output_queue.put(result)
+
+    def _outputLoop(self):
+        while True:
+            result = self.output_queue.get()
+            if result is None:
+                return
+            try:
+                none, latency = _timed(self.output, result)
+                with self.lock:
+                    self.timers['output'].add(latency)
+            except Exception as error:
+                with self.lock:
+                    self.errors += 1
+                print "Output failed: %r" % error
+
+    def stats(self):
+        """Return per-stage latency statistics and tick counters."""
+        with self.lock:
+            stats = dict((name, timer.stats()) for name, timer in self.timers.iteritems())
+            stats['ticks'] = self.ticks
+            stats['late_ticks'] = self.late_ticks
+            stats['missed_ticks'] = self.missed_ticks
+            stats['dropped_rows'] = self.dropped_rows
+            stats['errors'] = self.errors
+            stats['queue_depth'] = self.analysis_queue.qsize()
+        return stats
+
+
+#==================== FUNCTIONS ====================#
+
+def _timed(function, *args):
+    """Call function(*args) and return (result, seconds taken)."""
+    start_time = time.time()
+    result = function(*args)
+    return result, time.time() - start_time
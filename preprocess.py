@@ -0,0 +1,106 @@
+# Filename:     preprocess.py
+# Author(s):    based on pi_seq_BLR_AVG.py by apadin, dvorva, mjmor
+# Start Date:   2026-10-17
+
+"""Missing-data handling for sensor readings, run before Algo.run.
+
+A sensor that does not answer shows up as NaN (see pipeline.py) or as
+the -1 sentinel. A sensor that was turned off may also keep reporting
+its last value. Preprocessor looks at one row of sensor readings per
+tick and:
+
+ * carries the last good value forward while a sensor is missing, for
+   at most 'stale_limit' ticks
+ * after that, or for a sensor stuck on the same value for more than
+   'repeat_limit' ticks, emits the -1 sentinel instead
+
+Algo counts -1 as invalid data (see algoFunctions.validData), so a
+sensor that stays dead is left out of training once its coverage drops
+below Algo.min_feature_coverage. Every step works on whole rows with
+NumPy masks, so a tick costs O(number of sensors).
+
+Example:
+
+    preprocessor = Preprocessor(num_sensors, stale_limit=10)
+    row = preprocessor.process(readings)
+    print preprocessor.staleness()
+
+"""
+
+
+#==================== LIBRARIES ====================#
+import numpy as np
+
+
+#==================== PARAMETERS ====================#
+SENTINEL = -1
+
+
+#==================== CLASSES ====================#
+
+class Preprocessor(object):
+
+    def __init__(self, num_sensors, stale_limit=10, repeat_limit=0):
+        """
+        'stale_limit' is the number of ticks a missing reading is replaced
+        by the last good one (0 never carries values forward).
+        'repeat_limit' is the number of times the same value may be repeated
+        before the sensor is considered stuck (0 never does).
+        """
+        self.num_sensors = num_sensors
+        self.stale_limit = stale_limit
+        self.repeat_limit = repeat_limit
+
+        self.last_value = np.ones(num_sensors) * np.nan   # Last good value
+        self.last_seen = np.ones(num_sensors) * np.nan    # Last valid reading
+        self.stale_count = np.zeros(num_sensors, dtype=int)     # Ticks since last good value
+        self.repeat_count = np.zeros(num_sensors, dtype=int)    # Repeats of last reading
+        self.excluded = np.zeros(num_sensors, dtype=bool)       # Sentinel emitted this tick
+
+        # Totals since start
+        self.ticks = 0
+        self.missing_total = np.zeros(num_sensors, dtype=int)
+        self.imputed_total = np.zeros(num_sensors, dtype=int)
+        self.excluded_total = np.zeros(num_sensors, dtype=int)
+
+    def process(self, readings):
+        """Return the row of 'readings' with missing and stuck values handled."""
+        x = np.array(readings, dtype=float)
+        assert (np.shape(x) == (self.num_sensors,))
+
+        missing = np.isnan(x) | (np.trunc(x) == SENTINEL)
+        repeated = ~missing & (x == self.last_seen)
+        self.repeat_count = np.where(repeated, self.repeat_count + 1,
+                                     np.where(missing, self.repeat_count, 0))
+        self.last_seen = np.where(missing, self.last_seen, x)
+
+        stuck = repeated & (self.repeat_limit > 0) & (self.repeat_count >= self.repeat_limit)
+        good = ~missing & ~stuck
+        self.stale_count = np.where(good, 0, self.stale_count + 1)
+        self.last_value = np.where(good, x, self.last_value)
+
+        imputed = (missing & (self.stale_count <= self.stale_limit) &
+                   ~np.isnan(self.last_value))
+        self.excluded = ~good & ~imputed
+        row = np.where(good, x, np.where(imputed, self.last_value, SENTINEL))
+
+        self.ticks += 1
+        self.missing_total += missing
+        self.imputed_total += imputed
+        self.excluded_total += self.excluded
+        return row
+
+    def staleness(self):
+        """
+        Return a dictionary of per-sensor counters: ticks since the last
+        good value ('stale'), repeats of the current reading ('repeated'),
+        whether the sensor is excluded right now, and the number of missing,
+        imputed and excluded readings since the start.
+        """
+        return {'ticks': self.ticks,
+                'stale': self.stale_count.tolist(),
+                'repeated': self.repeat_count.tolist(),
+                'excluded': self.excluded.tolist(),
+                'missing_total': self.missing_total.tolist(),
+                'imputed_total': self.imputed_total.tolist(),
+                'excluded_total': self.excluded_total.tolist()}
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+# Filename:         replay.py
+# Contributors:     based on algo.py by apadin, dvorva, mjmor, yabskbd
+# Start Date:       2026-10-17
+
+"""
+
+Offline replay of recorded data through the sequential BLR
+
+Running weeks of recorded data through Algo.run one row at a time
+pays Python overhead on every sample. This module replays a whole
+(T x M+1) array at once (features in the first M columns, power in
+the last column) and reproduces the results Algo.run and
+Algo.checkSeverity would have given when fed the same rows:
+
+ * Smoothing of the input is done for the whole series at once
+   (see Smoother.smoothArray)
+ * Each training window is a slice of the input, no ring buffer
+ * Predictions and sigmas between two training sessions are
+   computed with one matrix product per segment
+ * The severity metric is evaluated for all rows with severitySeries
+
+Usage:
+
+    python replay.py <settings_file> [-o <results_file>]
+
+The input file named in the settings is a CSV file with a header
+row, a timestamp in the first column, the features in the
+following columns and the power in the last column. If the results
+file ends in '.bin', the results are written as a binary results
+store (see results.py) instead of CSV.
+
+"""
+
+
+#==================== LIBRARIES ====================#
+import sys
+import argparse
+import numpy as np
+
+import settings
+from algo import Algo
+from algoFunctions import train, updatePosterior, severitySeries, coverage, expandModel
+from algoFunctions import writeResults
+from results import ResultsStore
+from smoothing import fromSettings
+
+
+#==================== FUNCTIONS ====================#
+
+def replay(algo, data):
+    """
+    Run every row of 'data' through the analysis described by 'algo'.
+
+    The parameters of 'algo' (window length, forecasting interval, EMA,
+    severity, warm start and online settings) are used, but its state is
+    left untouched; the replay always starts from an empty window.
+
+    Returns the arrays (targets, predictions, sigmas, anomalies), one
+    entry per row. Predictions and sigmas are NaN before the first
+    training session.
+    """
+    data = np.asarray(data, dtype=float)
+    (T, num_columns) = np.shape(data)
+    M = algo.num_features
+    assert (num_columns == M + 1)
+
+    # Smoothing of the whole series at once (EMA with a linear filter)
+    smoothed = algo.smoother.smoothArray(data)
+
+    Phi = smoothed[:, :M]
+    targets = smoothed[:, M].copy()
+    predictions = np.empty(T) * np.nan
+    sigmas = np.empty(T) * np.nan
+    anomalies = np.zeros(T, dtype=bool)
+
+    # Training happens after row i is added if (i+1) is a multiple of the
+    # forecasting interval and the window is full (see Algo.run). The model
+    # trained on rows [end-L, end) predicts rows end-1 up to the next training.
+    # A skipped training leaves the model as it is; the segment still ends.
+    L = algo.matrix_length
+    F = algo.forecasting_interval
+    first = L + (-L) % F
+    init_training = False
+    w_opt, a_opt, b_opt, S_N = None, 0, 0, None
+    segment_start = 0
+    segment_trained = False  # Whether row segment_start was in the training window
+
+    for end in range(first, T + 1, F):
+        if init_training:
+            w_opt, S_N = _predictSegment(algo, Phi, targets, segment_start, end - 1,
+                                         w_opt, b_opt, S_N, segment_trained,
+                                         predictions, sigmas)
+
+        window = slice(end - L, end)
+        overall, per_feature = coverage(Phi[window])
+        features = per_feature >= algo.min_feature_coverage
+        trained = False
+        if np.any(features) and (init_training or overall > 0.5):
+            warm = algo.warm_start and init_training
+            ab_init = (a_opt, b_opt) if warm else None
+            w_opt, a_opt, b_opt, S_N = train(Phi[window][:, features], targets[window],
+                                             ab_init=ab_init)
+            w_opt, S_N = expandModel(features, w_opt, S_N)
+            init_training = True
+            trained = True
+        segment_start = end - 1
+        segment_trained = trained
+
+    if init_training:
+        _predictSegment(algo, Phi, targets, segment_start, T,
+                        w_opt, b_opt, S_N, segment_trained, predictions, sigmas)
+
+    valid = ~np.isnan(predictions)
+    errors = predictions[valid] - targets[valid]
+    anomalies[valid] = severitySeries(errors, sigmas[valid], algo.w, algo.L, algo.mu)[2]
+    return targets, predictions, sigmas, anomalies
+
+
+def _predictSegment(algo, Phi, t, start, end, w_opt, b_opt, S_N, trained,
+                    predictions, sigmas):
+    """
+    Fill 'predictions' and 'sigmas' in place for rows 'start' to 'end'-1,
+    all predicted with the same model. 'trained' tells whether row 'start'
+    was part of the window the model was just trained on. Returns the
+    posterior (w_opt, S_N), which only changes in online mode.
+    """
+    if not algo.online:
+        Phi = Phi[start:end]
+        predictions[start:end] = np.maximum(0, np.dot(Phi, w_opt))
+        variance = 1/b_opt + np.sum(np.dot(Phi, S_N) * Phi, axis=1)
+        sigmas[start:end] = np.maximum(1, np.sqrt(variance))
+        return w_opt, S_N
+
+    # Online mode folds every row into the posterior after predicting it,
+    # except a first row that was already part of the training window
+    for n in range(start, end):
+        x = Phi[n]
+        predictions[n] = max(0, np.inner(x, w_opt))
+        sigmas[n] = max(1, np.sqrt(1/b_opt + np.dot(x, np.dot(S_N, x))))
+        if n > start or not trained:
+            w_opt, S_N = updatePosterior(w_opt, S_N, b_opt, x, t[n], algo.forgetting)
+    return w_opt, S_N
+
+
+def loadCSV(filename):
+    """Return (timestamps, data) from a CSV file of recorded data."""
+    array = np.genfromtxt(filename, delimiter=',', skip_header=1)
+    return array[:, 0], array[:, 1:]
+
+
+#==================== MAIN ====================#
+def main(argv):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('settings_file', type=str)
+    parser.add_argument('-o', '--output', type=str, default='replay_results.csv',
+                        help="file to write the results to")
+    args = parser.parse_args(argv[1:])
+
+    try:
+        settings_dict = settings.load(args.settings_file)
+    except Exception as error:
+        print "Error reading settings file.", error
+        print " "
+        exit(1)
+
+    times, data = loadCSV(settings_dict['input_file'])
+    num_features = np.shape(data)[1] - 1
+
+    algo = Algo(int(settings_dict['granularity']),
+                int(settings_dict['training_window']),
+                int(settings_dict['training_interval']),
+                num_features)
+    algo.setSeverityParameters(float(settings_dict['severity_omega']),
+                               float(settings_dict['severity_lambda']))
+    algo.setSmoothing(*fromSettings(settings_dict))
+    algo.setFeatureCoverage(float(settings_dict.get('min_feature_coverage', 0)))
+    algo.setWarmStart(bool(settings_dict.get('warm_start', False)))
+
+    targets, predictions, sigmas, anomalies = replay(algo, data)
+
+    valid = ~np.isnan(predictions)
+    print "Replayed %d rows, %d predictions, %d anomalies" % (
+        len(targets), np.sum(valid), np.sum(anomalies))
+
+    if args.output.endswith('.bin'):
+        store = ResultsStore(args.output)
+        store.extend(zip(times[valid], targets[valid], predictions[valid], anomalies[valid]))
+        store.close()
+    else:
+        writeResults(args.output, (
+            ['Timestamp'] + [int(t) for t in times[valid]],
+            ['Target'] + list(targets[valid]),
+            ['Prediction'] + list(predictions[valid]),
+            ['Anomaly'] + [int(a) for a in anomalies[valid]]))
+
+
+#==================== DRIVER ====================#
+if __name__ == "__main__":
+    main(sys.argv)
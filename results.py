@@ -0,0 +1,263 @@
+# Filename:     results.py
+# Author(s):    based on algoFunctions.py by dvorva, mjmor, apadin
+# Start Date:   2026-10-17
+
+"""Append-only results log shared by the drivers and the grapher.
+
+The drivers used to rewrite the whole scrolling window of results with
+writeResults on every prediction, so each write cost O(window) and the
+grapher could read a half-written file. ResultsLog instead appends one
+CSV row per prediction. Once the file holds twice the window, it is
+compacted down to the most recent window by writing a new file and
+renaming it over the old one, which is atomic.
+
+Readers follow the file with ResultsTail, which remembers the byte
+offset it has read up to and only parses the rows appended since. A
+compaction is detected by the file being replaced, after which the
+reader starts again from the top of the new file. ResultsBuffer keeps
+the most recent rows read this way in preallocated NumPy arrays.
+
+Alongside the CSV log, ResultsStore keeps the full history in a binary
+file of fixed-width records (RESULTS_DTYPE). readStore memory-maps that
+file, so the grapher and offline analysis can use the columns directly
+without parsing anything. exportCSV turns a store back into the CSV
+format.
+
+File format (same as before, see grapher.py):
+
+    Timestamp,Target,Prediction,Anomaly
+    1464763755,9530,9683,0
+
+"""
+
+
+#==================== LIBRARIES ====================#
+import os
+import csv
+import time
+import numpy as np
+from collections import deque
+
+from param import DATE_FORMAT
+
+
+#==================== PARAMETERS ====================#
+HEADER = ['Timestamp', 'Target', 'Prediction', 'Anomaly']
+
+# One record of the binary results store (25 bytes, little-endian)
+RESULTS_DTYPE = np.dtype([('time', '<f8'),          # seconds since the epoch
+                          ('target', '<f8'),
+                          ('prediction', '<f8'),
+                          ('anomaly', 'u1')])
+
+
+#==================== CLASSES ====================#
+
+class ResultsLog(object):
+
+    def __init__(self, filename, max_rows, header=HEADER):
+        """
+        Open the log 'filename' for appending, creating it with 'header'
+        if needed. At least the last 'max_rows' rows are always kept.
+        """
+        self.filename = filename
+        self.max_rows = max_rows
+        self.header = header
+
+        if not os.path.exists(filename):
+            self._replace([])
+        with open(filename, 'rb') as infile:
+            self.row_count = max(0, sum(1 for line in infile) - 1)
+        self.outfile = open(filename, 'ab')
+        self.writer = csv.writer(self.outfile)
+
+    def append(self, row):
+        """Append one row to the log; compact it when it gets too long."""
+        self.writer.writerow(row)
+        self.outfile.flush()
+        self.row_count += 1
+        if self.row_count >= 2 * self.max_rows:
+            self.compact()
+
+    def compact(self):
+        """Keep only the last 'max_rows' rows, atomically replacing the file."""
+        self.outfile.close()
+        with open(self.filename, 'rb') as infile:
+            infile.readline()
+            lines = deque(infile, maxlen=self.max_rows)
+        self._replace(lines)
+        self.row_count = len(lines)
+        self.outfile = open(self.filename, 'ab')
+        self.writer = csv.writer(self.outfile)
+
+    def _replace(self, lines):
+        """Write the header and 'lines' to a new file and rename it into place."""
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'wb') as outfile:
+            csv.writer(outfile).writerow(self.header)
+            outfile.writelines(lines)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.rename(temp_filename, self.filename)
+
+    def close(self):
+        self.outfile.close()
+
+
+class ResultsTail(object):
+
+    def __init__(self, filename):
+        """Follow the results log 'filename' from its beginning."""
+        self.filename = filename
+        self.offset = 0
+        self.inode = None
+
+    def read(self):
+        """
+        Return (rows, reset): the complete rows appended since the last
+        call as lists of strings, and whether the file was replaced (or
+        truncated) since then, in which case 'rows' holds the whole new
+        file and anything read earlier should be discarded.
+        """
+        try:
+            infile = open(self.filename, 'rb')
+        except IOError:
+            return [], False
+
+        with infile:
+            stat = os.fstat(infile.fileno())
+            reset = (self.inode is not None and
+                     (stat.st_ino != self.inode or stat.st_size < self.offset))
+            if reset or self.inode is None:
+                self.offset = 0
+            self.inode = stat.st_ino
+
+            infile.seek(self.offset)
+            data = infile.read()
+
+        # Only consume complete lines; a partly written row is read next time
+        end = data.rfind('\n') + 1
+        lines = data[:end].splitlines()
+        if self.offset == 0 and lines:
+            lines = lines[1:]   # Header
+        self.offset += end
+        return list(csv.reader(lines)), reset
+
+
+class ResultsBuffer(object):
+
+    def __init__(self, capacity):
+        """
+        Keep the last 'capacity' rows of results in NumPy arrays: times
+        (seconds since the epoch), targets, predictions and anomalies.
+        The arrays are allocated once, with room for 'capacity' extra
+        rows so that old rows only have to be moved out now and then.
+        """
+        self.capacity = capacity
+        self.data = np.zeros([4, 2 * capacity])
+        self.start = 0
+        self.end = 0
+        self.has_anomalies = True
+
+    def clear(self):
+        self.start = 0
+        self.end = 0
+
+    def extend(self, rows):
+        """Parse 'rows' (lists of strings, see ResultsTail) and add them."""
+        rows = rows[-self.capacity:]
+        if not rows:
+            return
+        columns = zip(*rows)
+        n = len(rows)
+
+        if self.end + n > len(self.data[0]):
+            keep = min(self.end - self.start, self.capacity - n)
+            self.data[:, :keep] = self.data[:, self.end - keep:self.end]
+            self.start, self.end = 0, keep
+
+        new = self.data[:, self.end:self.end + n]
+        try:
+            new[0] = np.array(columns[0], dtype=float)
+        except ValueError:
+            new[0] = [time.mktime(time.strptime(t, DATE_FORMAT)) for t in columns[0]]
+        new[1] = np.array(columns[1], dtype=float)
+        new[2] = np.array(columns[2], dtype=float)
+        if len(columns) >= 4:
+            new[3] = np.array(columns[3], dtype=float)
+        else:
+            new[3] = 0
+            self.has_anomalies = False
+
+        self.end += n
+        self.start = max(self.start, self.end - self.capacity)
+
+    def __len__(self):
+        return self.end - self.start
+
+    # Views of the current rows, oldest first
+    @property
+    def times(self):
+        return self.data[0, self.start:self.end]
+
+    @property
+    def targets(self):
+        return self.data[1, self.start:self.end]
+
+    @property
+    def predictions(self):
+        return self.data[2, self.start:self.end]
+
+    @property
+    def anomalies(self):
+        return self.data[3, self.start:self.end]
+
+
+class ResultsStore(object):
+
+    def __init__(self, filename):
+        """Open the binary results store 'filename' for appending."""
+        self.filename = filename
+        self.outfile = open(filename, 'ab')
+
+        # Drop a partly written record, e.g. after a crash
+        size = os.fstat(self.outfile.fileno()).st_size
+        if size % RESULTS_DTYPE.itemsize:
+            self.outfile.truncate(size - size % RESULTS_DTYPE.itemsize)
+
+    def append(self, row):
+        """Append one (time, target, prediction, anomaly) row."""
+        self.extend([row])
+
+    def extend(self, rows):
+        """Append a sequence of rows (or an array of RESULTS_DTYPE records)."""
+        records = np.array([tuple(row) for row in rows], dtype=RESULTS_DTYPE)
+        self.outfile.write(records.tostring())
+        self.outfile.flush()
+
+    def close(self):
+        self.outfile.close()
+
+
+#==================== FUNCTIONS ====================#
+
+def readStore(filename, last=None):
+    """
+    Memory-map the binary results store 'filename' and return its records
+    (only the 'last' ones, if given) as a read-only array of RESULTS_DTYPE.
+    Columns such as records['target'] are views of the file, not copies.
+    """
+    count = os.path.getsize(filename) // RESULTS_DTYPE.itemsize
+    start = 0 if last is None else max(0, count - last)
+    if count == start:
+        return np.zeros(0, dtype=RESULTS_DTYPE)
+    return np.memmap(filename, dtype=RESULTS_DTYPE, mode='r',
+                     offset=start * RESULTS_DTYPE.itemsize, shape=(count - start,))
+
+
+def exportCSV(store_filename, csv_filename):
+    """Write the binary results store 'store_filename' as a results CSV file."""
+    records = readStore(store_filename)
+    with open(csv_filename, 'wb') as outfile:
+        csv.writer(outfile).writerow(HEADER)
+        np.savetxt(outfile, records, fmt=['%.17g', '%.17g', '%.17g', '%d'], delimiter=',')
@@ -30,22 +30,35 @@ existing program. This includes:
 #==================== LIBRARIES ====================#
 import os
 import sys
-import time
 import argparse
 import numpy as np
 
 import settings
 import zway
 from algo import Algo
+from trainer import TrainingExecutor
+from pipeline import Pipeline
+from sound import SoundLevel
+from results import ResultsLog, ResultsStore
+from preprocess import Preprocessor
+from smoothing import fromSettings
+from param import RESULTS_FILE, RESULTS_STORE_FILE, BACKUP_FILE
 
 #==================== FUNCTIONS ====================#
-def collect_features(zserver):
-    feature_list = []
-    for key in sorted(zserver.device_IDs()):
-        feature_list.append(zserver.get_data(key))
-    feature_list.append(np.random.rand())
+def collect_features(zserver, snapshot=False):
+    if snapshot:
+        feature_list = zserver.get_snapshot()
+    else:
+        feature_list = zserver.get_all_data()
     return np.array(feature_list)
 
+def collect_power():
+    return np.random.rand()
+
+def trainingSummary(info):
+    return ("row %(row_count)d: %(iterations)d iterations, %(duration).3f s, "
+            "warm start %(warm_start)s, converged %(converged)s" % info)
+
 #==================== MAIN ====================#
 def main(argv):
     
@@ -55,8 +68,12 @@ def main(argv):
     parser = argparse.ArgumentParser()
     parser.add_argument('settings_file', type=str)
     parser.add_argument('-s', '--sound', action='store_true', help="use sound as a feature in analysis")
-    parser.add_argument('-b', '--backup', action='store_true', help="start training on backup data")
+    parser.add_argument('-b', '--backup', action='store_true', help="continue from the last checkpoint and keep saving checkpoints")
     parser.add_argument('-t', '--time_allign', action='store_true', help="collect data at times which are multiples of the granularity")
+    parser.add_argument('-n', '--snapshot', action='store_true', help="read all sensors from the server's data tree in one request")
+    parser.add_argument('-m', '--memmap', action='store_true', help="keep the training window in the checkpoint file instead of in memory")
+    parser.add_argument('--float32', action='store_true', help="with -m, store the training window as float32")
+    parser.add_argument('-p', '--processes', type=int, default=0, help="train in this many background processes (0 trains in the main loop)")
     args = parser.parse_args(argv[1:])
         
     # Initialize Zway server
@@ -76,50 +93,103 @@ def main(argv):
     granularity = int(settings_dict['granularity'])
     training_window = int(settings_dict['training_window'])
     training_interval = int(settings_dict['training_interval'])
-    ema_alpha = float(settings_dict['ema_alpha'])
     severity_omega = float(settings_dict['severity_omega'])
     severity_lambda = float(settings_dict['severity_lambda'])
     auto_regression = int(settings_dict['auto_regression'])
-    num_features = len(zserver.device_IDs())
+    num_sensors = len(zserver.device_IDs())
+    num_features = num_sensors
+    if args.sound:
+        num_features += 1
     
     print "Num features: ", num_features
     
     algo = Algo(granularity, training_window, training_interval, num_features)
     algo.setSeverityParameters(severity_omega, severity_lambda)
-    algo.setEMAParameter(ema_alpha)
+    algo.setSmoothing(*fromSettings(settings_dict))
+    algo.setFeatureCoverage(float(settings_dict.get('min_feature_coverage', 0)))
+    algo.setWarmStart(bool(settings_dict.get('warm_start', False)))
+    if args.processes > 0:
+        algo.setExecutor(TrainingExecutor(args.processes))
+
+    # Continue from the last checkpoint, if any (see checkpoint.py)
+    # A memory-mapped training window always lives in the checkpoint
+    window_dtype = np.float32 if args.float32 else np.float64
+    if args.backup:
+        try:
+            algo.fromBackup(BACKUP_FILE, memmap=args.memmap, dtype=window_dtype)
+            print "Backup restored, continuing from row", algo.row_count
+        except (IOError, RuntimeError) as error:
+            print "***WARNING: Unable to use backup (%s), starting a new one.***" % error
+            algo.setBackup(BACKUP_FILE, memmap=args.memmap, dtype=window_dtype)
+    elif args.memmap:
+        algo.setBackup(BACKUP_FILE, memmap=True, dtype=window_dtype)
     
     # Timing procedure
     granularity = settings_dict['granularity'] * 60
     granularity = 1
-    goal_time = time.time()
-    if args.time_allign:
-        goal_time = int(goal_time) + granularity - (int(time.time()) % granularity)
 
     #===== Analysis =====#
-    
-    while(True):
-    
-        # Timing procedures
-        while goal_time > time.time():
-            time.sleep(0.2)
-        goal_time = goal_time + granularity
-        
-        # Data collection
-        features = collect_features(zserver)
+
+    # Data collection
+    sources = [('sensors', lambda: collect_features(zserver, args.snapshot), num_sensors)]
+    if args.sound:
+        sound_level = SoundLevel()
+        sources.append(('sound', sound_level.level, 1))
+    sources.append(('power', collect_power, 1))
+
+    # Missing sensor data is carried forward for a while, then excluded
+    preprocessor = Preprocessor(num_features,
+                                stale_limit=int(settings_dict.get('stale_limit', 10)),
+                                repeat_limit=int(settings_dict.get('repeat_limit', 0)))
+
+    # Data analysis
+    last_training = [None]  # Last train_log entry printed
+    def analyze(timestamp, features):
+        # Power did not arrive in time: no target to train on or predict
+        if np.isnan(features[-1]):
+            print "No power reading, row skipped"
+            return None
+        features[:-1] = preprocessor.process(features[:-1])
         print list(features)
-        
-        # Data analysis
         target, pred = algo.run(features)
+        if algo.train_log and algo.train_log[-1] is not last_training[0]:
+            last_training[0] = algo.train_log[-1]
+            print "trained", trainingSummary(last_training[0])
         if (pred != None):
-            print target, pred, algo.checkSeverity(target, pred)
+            anomaly = algo.checkSeverity(target, pred)
+            print target, pred, anomaly
             print "theta", algo.w_opt
+            if algo.executor is not None:
+                print "training", algo.trainingMetrics()
+            return (timestamp, target, pred, anomaly)
         else:
             print target, pred
-        
-        # Record results
+            return None
+
+    # Record results
+    results_log = ResultsLog(RESULTS_FILE, algo.matrix_length)
+    results_store = ResultsStore(RESULTS_STORE_FILE)
+    def output(result):
+        timestamp, target, pred, anomaly = result
+        results_log.append((timestamp, target, pred, int(anomaly)))
+        results_store.append(result)
+        print "zway", zserver.connection_stats()
+        print "pipeline", pipe.stats()
+        print "staleness", preprocessor.staleness()
+
+    pipe = Pipeline(sources, analyze, output, granularity, time_allign=args.time_allign)
+    pipe.run()
 
-        
     # Clean-up if necessary
+    if algo.checkpoint is not None:
+        algo.saveCheckpoint()
+        algo.checkpoint.close()
+    if algo.executor is not None:
+        algo.executor.close()
+    if args.sound:
+        sound_level.close()
+    results_log.close()
+    results_store.close()
 
         
 #==================== DRIVER ====================#
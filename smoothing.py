@@ -0,0 +1,203 @@
+# Filename:     smoothing.py
+# Author(s):    based on algo.py and pi_seq_BLR_AVG.py by apadin, dvorva, mjmor
+# Start Date:   2026-10-17
+
+"""Smoothing of incoming data rows, shared by all drivers.
+
+Smoother filters one row of data per tick, all columns at once:
+
+ * 'ema'     exponential moving average, s = (1-alpha)*s + alpha*x
+             (the smoothing Algo.run has always done)
+ * 'boxcar'  mean of the last 'window' rows, kept as a running sum
+ * 'median'  median of the last 'window' rows
+ * 'none'    no smoothing
+
+Rows may be arrays of any shape (e.g. one row per stream in AlgoPool).
+The last 'window' rows are kept in a ring buffer, so a tick costs a
+constant number of vector operations. Until 'window' rows have been
+seen, the boxcar and median use the rows seen so far. smoothArray
+filters a whole recorded series at once and gives the same result as
+feeding its rows to a new Smoother one at a time.
+
+Invalid data (the -1 marker, see algoFunctions.validData, or NaN) is
+not smoothed: it is passed on as -1, so that Algo still sees it as
+invalid, and it is kept out of the average of the valid values around
+it (except with 'none', which passes every value on unchanged).
+
+Drivers read the method from the settings file ('smoothing',
+'smoothing_window' and 'ema_alpha', see fromSettings).
+
+"""
+
+
+#==================== LIBRARIES ====================#
+import warnings
+import numpy as np
+import scipy.signal
+from numpy.lib.stride_tricks import as_strided
+
+from algoFunctions import validData
+
+
+#==================== PARAMETERS ====================#
+METHODS = ('none', 'ema', 'boxcar', 'median')
+
+
+#==================== CLASSES ====================#
+
+class Smoother(object):
+
+    def __init__(self, shape, method='ema', window=1, alpha=1.0):
+        """
+        'shape' is the number of columns of a row (or the shape of a row).
+        'window' is used by 'boxcar' and 'median', 'alpha' by 'ema'.
+        """
+        assert (method in METHODS), "unknown smoothing method %r" % method
+        assert (window >= 1)
+        assert (0 < alpha <= 1)
+        self.shape = tuple(np.atleast_1d(shape))
+        self.method = method
+        self.window = int(window)
+        self.alpha = alpha
+
+        # Last rows (ring buffer), NaN where there is no valid value
+        self.buffer = np.ones((self.window,) + self.shape) * np.nan
+        self.total = np.zeros(self.shape)               # Sum of the valid values in the buffer
+        self.valid = np.zeros(self.shape, dtype=int)    # Number of valid values in the buffer
+        self.average = np.ones(self.shape) * np.nan     # EMA of the valid values
+        self.last = np.zeros(self.shape)                # Last smoothed row
+        self.count = 0
+
+    def smooth(self, row):
+        """Add 'row' and return the smoothed row."""
+        x = np.array(row, dtype=float)
+        assert (np.shape(x) == self.shape)
+        valid = _valid(x)
+
+        if self.method == 'none':
+            smoothed = x
+        elif self.method == 'ema':
+            first = np.isnan(self.average)
+            self.average = np.where(~valid, self.average,
+                                    np.where(first, x, (1 - self.alpha)*self.average + self.alpha*x))
+            smoothed = self.average
+        else:
+            position = self.count % self.window
+            old = self.buffer[position]
+            old_valid = ~np.isnan(old)
+            self.total += np.where(valid, x, 0) - np.where(old_valid, old, 0)
+            self.valid += valid.astype(int) - old_valid
+            self.buffer[position] = np.where(valid, x, np.nan)
+
+            # Recompute the sum once per pass through the buffer so that
+            # rounding errors from the updates cannot accumulate
+            if position == self.window - 1:
+                self.total = np.nansum(self.buffer, axis=0)
+
+            if self.method == 'boxcar':
+                smoothed = self.total / np.maximum(self.valid, 1)
+            else:
+                smoothed = _nanmedian(self.buffer, axis=0)
+
+        self.last = smoothed if self.method == 'none' else np.where(valid, smoothed, -1.0)
+
+        self.count += 1
+        return self.last.copy()
+
+    def smoothArray(self, data):
+        """
+        Return the smoothed version of the series 'data' (rows on the first
+        axis), as a new Smoother would give it row by row. The state of
+        this Smoother is not used or changed.
+        """
+        data = np.asarray(data, dtype=float)
+        assert (np.shape(data)[1:] == self.shape)
+        T = len(data)
+        w = self.window
+
+        if self.method == 'none' or T == 0:
+            return data.copy()
+        valid = _valid(data)
+
+        if self.method == 'ema':
+            # s[0] = d[0], s[n] = (1-a)*s[n-1] + a*d[n], over the valid
+            # values of each column
+            a = self.alpha
+            columns = np.reshape(data, (T, -1))
+            columns_valid = np.reshape(valid, (T, -1))
+            smoothed = np.empty(np.shape(columns))
+            for j in range(np.shape(columns)[1]):
+                values = columns[columns_valid[:, j], j]
+                if a < 1.0 and len(values) > 1:
+                    rest, _ = scipy.signal.lfilter([a], [1, -(1 - a)], values[1:],
+                                                   zi=[(1 - a) * values[0]])
+                    values = np.concatenate((values[:1], rest))
+                smoothed[columns_valid[:, j], j] = values
+            smoothed = np.reshape(smoothed, np.shape(data))
+
+        else:
+            # Boxcar and median: every window is a strided view of the data,
+            # padded at the start with w-1 rows of no valid values
+            padding = np.zeros((w - 1,) + self.shape)
+            values = np.concatenate((padding, np.where(valid, data, 0)))
+            counts = np.concatenate((padding, valid.astype(float)))
+            shape = (T, w) + self.shape
+            if self.method == 'boxcar':
+                totals = np.sum(as_strided(values, shape=shape,
+                                           strides=(values.strides[0],) + values.strides), axis=1)
+                valid_counts = np.sum(as_strided(counts, shape=shape,
+                                                 strides=(counts.strides[0],) + counts.strides), axis=1)
+                smoothed = totals / np.maximum(valid_counts, 1)
+            else:
+                values[counts == 0] = np.nan
+                smoothed = _nanmedian(as_strided(values, shape=shape,
+                                                 strides=(values.strides[0],) + values.strides),
+                                      axis=1)
+
+        return np.where(valid, smoothed, -1.0)
+
+    def state(self):
+        """Return the state of the smoother as a dictionary (for backups)."""
+        return {'method': self.method, 'window': self.window, 'alpha': self.alpha,
+                'buffer': self.buffer.copy(), 'total': self.total.copy(),
+                'valid': self.valid.copy(), 'average': self.average.copy(),
+                'last': self.last.copy(), 'count': self.count}
+
+    def restore(self, state):
+        """Continue from a state saved with state(). Raises ValueError if
+        it was saved by a smoother with different settings."""
+        if not isinstance(state, dict) or 'valid' not in state:
+            raise ValueError("not a smoother state")
+        if (state['method'], state['window'], state['alpha']) != (
+                self.method, self.window, self.alpha):
+            raise ValueError("smoother settings do not match")
+        if np.shape(state['buffer']) != np.shape(self.buffer):
+            raise ValueError("smoother state not properly sized")
+        self.buffer = np.array(state['buffer'], dtype=float)
+        self.total = np.array(state['total'], dtype=float)
+        self.valid = np.array(state['valid'], dtype=int)
+        self.average = np.array(state['average'], dtype=float)
+        self.last = np.array(state['last'], dtype=float)
+        self.count = state['count']
+
+
+#==================== FUNCTIONS ====================#
+
+def _valid(x):
+    """True where 'x' holds valid data (neither the -1 marker nor NaN)."""
+    return validData(x) & ~np.isnan(x)
+
+
+def _nanmedian(x, axis):
+    """np.nanmedian, without the warning for columns with no valid value."""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmedian(x, axis=axis)
+
+
+def fromSettings(settings_dict):
+    """Return the (method, window, alpha) smoothing settings of a settings
+    dictionary. Without a 'smoothing' entry the EMA is used, as before."""
+    return (settings_dict.get('smoothing', 'ema'),
+            int(settings_dict.get('smoothing_window', 1)),
+            float(settings_dict.get('ema_alpha', 1.0)))
@@ -0,0 +1,174 @@
+# Filename:     sound.py
+# Author(s):    based on get_data.py and noise.py by mjmor
+# Start Date:   2026-10-17
+
+"""Continuous sound level sensor.
+
+get_data.get_sound starts a new 'arecord | sox stat' pipeline for
+every sample and blocks for the whole recording. SoundLevel instead
+keeps one capture stream open and reads it on a background thread,
+computing the maximum and RMS amplitude over a rolling window with
+NumPy as the audio comes in. The latest values are available at any
+time without waiting.
+
+Amplitudes are normalized to [0, 1] like the "Maximum amplitude" and
+"RMS amplitude" reported by sox. The capture stream is raw signed
+16-bit little-endian audio; a WAV file (WavStream) or a synthetic
+signal (SyntheticStream) can stand in for the microphone.
+
+Example:
+
+    sound = SoundLevel()            # start arecord on the USB microphone
+    print sound.level()             # max amplitude over the last second
+                                    # (NaN until audio has been read)
+    sound.close()
+
+"""
+
+
+#==================== LIBRARIES ====================#
+import time
+import wave
+import threading
+import subprocess
+import numpy as np
+from collections import deque
+
+
+#==================== PARAMETERS ====================#
+ARECORD_COMMAND = "/usr/bin/arecord -q -D {} -f S16_LE -c 1 -r {} -t raw"
+DEVICE = "plughw:1,0"
+SAMPLE_RATE = 8000
+FULL_SCALE = 32768.0
+
+
+#==================== CLASSES ====================#
+
+class SoundLevel(object):
+
+    def __init__(self, stream=None, rate=SAMPLE_RATE, channels=1, window=1.0, chunk=0.1,
+                 device=DEVICE):
+        """
+        Start reading audio from 'stream', a file-like object giving raw
+        S16_LE samples. If no stream is given, arecord is started on the
+        microphone given by the ALSA 'device'. Levels are computed over
+        the last 'window' seconds, updated every 'chunk' seconds of audio.
+        """
+        self.process = None
+        if stream is None:
+            self.process = subprocess.Popen(ARECORD_COMMAND.format(device, rate).split(),
+                                            stdout=subprocess.PIPE)
+            stream = self.process.stdout
+        self.stream = stream
+        self.channels = channels
+        self.chunk_bytes = 2 * channels * max(1, int(rate * chunk))
+
+        # (max amplitude, sum of squares, number of samples) of each chunk
+        self.chunks = deque(maxlen=max(1, int(round(window / chunk))))
+        self.lock = threading.Lock()
+        self.latest_max = None
+        self.latest_rms = None
+        self.updated = None
+        self.running = True
+
+        self.thread = threading.Thread(target=self._readLoop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _readLoop(self):
+        """Read chunks from the stream until it ends or close() is called."""
+        leftover = ''
+        while self.running:
+            data = self.stream.read(self.chunk_bytes)
+            if not data:
+                break
+            data = leftover + data
+            usable = len(data) - len(data) % (2 * self.channels)
+            leftover = data[usable:]
+            if usable == 0:
+                continue
+
+            samples = np.frombuffer(data[:usable], dtype='<i2')
+            samples = samples.reshape(-1, self.channels)[:, 0] / FULL_SCALE
+            self.chunks.append((np.max(np.abs(samples)),
+                                np.dot(samples, samples),
+                                len(samples)))
+
+            maxima, squares, counts = zip(*self.chunks)
+            with self.lock:
+                self.latest_max = max(maxima)
+                self.latest_rms = np.sqrt(sum(squares) / sum(counts))
+                self.updated = time.time()
+        self.running = False
+
+    def level(self):
+        """Return the maximum amplitude over the last window, or NaN if
+        no audio is available (e.g. arecord failed or has not started)."""
+        try:
+            return self.levels()[0]
+        except IOError:
+            return float('nan')
+
+    def levels(self):
+        """Return (max amplitude, RMS amplitude) over the last window.
+        Raises an exception if no audio has been read yet or the
+        stream has ended."""
+        with self.lock:
+            if self.latest_max is None or not self.running:
+                raise IOError("no audio available")
+            return self.latest_max, self.latest_rms
+
+    def close(self):
+        """Stop reading and terminate arecord, if it was started."""
+        self.running = False
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+
+
+class WavStream(object):
+    """File-like object giving the raw samples of a WAV file, optionally
+    paced in real time and looped, to stand in for the microphone."""
+
+    def __init__(self, filename, realtime=True, loop=False):
+        self.wav = wave.open(filename, 'rb')
+        assert self.wav.getsampwidth() == 2, "only 16-bit WAV files are supported"
+        self.channels = self.wav.getnchannels()
+        self.rate = self.wav.getframerate()
+        self.realtime = realtime
+        self.loop = loop
+
+    def read(self, num_bytes):
+        frames = num_bytes // (2 * self.channels)
+        data = self.wav.readframes(frames)
+        if not data and self.loop:
+            self.wav.rewind()
+            data = self.wav.readframes(frames)
+        if self.realtime:
+            time.sleep(float(len(data)) / (2 * self.channels * self.rate))
+        return data
+
+
+class SyntheticStream(object):
+    """File-like object generating a sine tone with Gaussian noise."""
+
+    def __init__(self, amplitude=0.5, frequency=440.0, noise=0.01, rate=SAMPLE_RATE,
+                 realtime=True, seed=None):
+        self.amplitude = amplitude
+        self.frequency = frequency
+        self.noise = noise
+        self.rate = rate
+        self.realtime = realtime
+        self.random = np.random.RandomState(seed)
+        self.position = 0
+
+    def read(self, num_bytes):
+        n = num_bytes // 2
+        t = (self.position + np.arange(n)) / float(self.rate)
+        self.position += n
+        signal = (self.amplitude * np.sin(2 * np.pi * self.frequency * t)
+                  + self.noise * self.random.randn(n))
+        samples = np.clip(np.round(signal * FULL_SCALE), -FULL_SCALE, FULL_SCALE - 1)
+        if self.realtime:
+            time.sleep(float(n) / self.rate)
+        return samples.astype('<i2').tostring()
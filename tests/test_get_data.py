@@ -0,0 +1,128 @@
+# Filename:     test_get_data.py
+# Tests for get_data.PowerSource, with an in-memory SQLite table standing
+# in for the MS SQL power database
+#
+# Run from the top of the repository:
+#     python -m unittest discover -s tests
+
+import sqlite3
+import unittest
+import datetime as dt
+import numpy as np
+
+from get_data import PowerSource
+
+
+CONFIG = {
+    "database": {
+        "credentials": {
+            "database_name": "power",
+            "username": "", "password": "", "host": "", "port": "",
+        },
+        "table": {
+            "name": "readings",
+            "data_columns": ["shark_1", "shark_2"],
+            "time_column": "time",
+        },
+    },
+}
+
+START = dt.datetime(2016, 6, 1, 12, 0, 0)
+
+
+# Connection to the shared in-memory database that can be told to fail
+# its next queries; close() only marks it closed
+class FlakyConnection(object):
+
+    def __init__(self, db, failures):
+        self.db = db
+        self.failures = failures
+        self.closed = False
+
+    def cursor(self):
+        if self.failures[0] > 0:
+            self.failures[0] -= 1
+            raise sqlite3.OperationalError("connection lost")
+        return self.db.cursor()
+
+    def close(self):
+        self.closed = True
+
+
+class PowerSourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.execute("CREATE TABLE readings (time TEXT, shark_1 REAL, shark_2 REAL)")
+        # One reading every 20 seconds for 10 minutes, power = 10*i + 1
+        self.db.executemany("INSERT INTO readings VALUES (?, ?, ?)", [
+            ((START + dt.timedelta(seconds=20*i)).strftime('%Y-%m-%d %H:%M:%S'), 10*i, 1)
+            for i in range(30)])
+
+        self.failures = [0]
+        self.connections = []
+        self.sleeps = []
+
+    def tearDown(self):
+        self.db.close()
+
+    def connect(self):
+        connection = FlakyConnection(self.db, self.failures)
+        self.connections.append(connection)
+        return connection
+
+    def source(self, **kwargs):
+        return PowerSource(CONFIG, connect=self.connect, dialect='sqlite',
+                           sleep=self.sleeps.append, **kwargs)
+
+    def test_get_power(self):
+        # Average of the last four readings (i = 26..29), clipped at zero
+        source = self.source()
+        expected = sum(10*i + 1 for i in range(26, 30)) / 4.0
+        self.assertAlmostEqual(source.get_power(), expected)
+        self.assertAlmostEqual(source.get_power(), expected)
+        self.assertEqual(len(self.connections), 1)
+
+    def test_get_power_range(self):
+        # Three readings per minute; the last bucket has no readings
+        source = self.source()
+        times, power = source.get_power_range(START, START + dt.timedelta(minutes=11))
+        self.assertEqual(len(times), 11)
+        self.assertEqual(times[1] - times[0], 60)
+        expected = [np.mean([10*i + 1 for i in range(3*m, 3*m + 3)]) for m in range(10)]
+        np.testing.assert_allclose(power[:10], expected)
+        self.assertTrue(np.isnan(power[10]))
+
+        # Other bucket sizes, and an empty range
+        times, power = source.get_power_range(START, START + dt.timedelta(minutes=2), 120)
+        np.testing.assert_allclose(power, [np.mean([10*i + 1 for i in range(6)])])
+        times, power = source.get_power_range(START - dt.timedelta(minutes=5), START)
+        self.assertEqual(len(times), 5)
+        self.assertTrue(np.all(np.isnan(power)))
+
+    def test_reconnect_after_failed_query(self):
+        source = self.source()
+        source.get_power()
+        self.failures[0] = 2
+        self.assertAlmostEqual(source.get_power(), sum(10*i + 1 for i in range(26, 30)) / 4.0)
+        self.assertEqual(len(self.connections), 3)
+        self.assertTrue(self.connections[0].closed and self.connections[1].closed)
+        self.assertEqual(self.sleeps, [1, 2])
+
+    def test_query_keeps_failing(self):
+        source = self.source(max_attempts=3)
+        self.failures[0] = 10
+        self.assertRaises(sqlite3.OperationalError, source.get_power)
+        self.assertEqual(self.sleeps, [1, 2])
+
+    def test_programming_error_is_raised(self):
+        # A broken query is not retried (here: a missing parameter)
+        source = self.source()
+        self.assertRaises(sqlite3.ProgrammingError, source._execute,
+                          source.range_query, (START,))
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(len(self.connections), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
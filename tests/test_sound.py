@@ -0,0 +1,107 @@
+# Filename:     test_sound.py
+# Tests for sound.SoundLevel, with a WAV file or a synthetic tone standing
+# in for the microphone
+#
+# Run from the top of the repository:
+#     python -m unittest discover -s tests
+
+import os
+import time
+import wave
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+
+from sound import SoundLevel, WavStream, SyntheticStream, SAMPLE_RATE, FULL_SCALE
+
+
+# Stream that gives no audio until it is released, like arecord starting up
+class SilentStartStream(object):
+
+    def __init__(self):
+        self.released = threading.Event()
+
+    def read(self, num_bytes):
+        self.released.wait()
+        return ''
+
+
+class SoundLevelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sounds = []
+
+    def tearDown(self):
+        for sound in self.sounds:
+            sound.close()
+            sound.thread.join(5)
+        shutil.rmtree(self.directory)
+
+    def soundLevel(self, stream, **kwargs):
+        sound = SoundLevel(stream, **kwargs)
+        self.sounds.append(sound)
+        return sound
+
+    def writeWav(self, samples, channels=1):
+        """Write 'samples' (floats in [-1, 1], one column per channel)
+        to a 16-bit WAV file and return its name."""
+        filename = os.path.join(self.directory, 'test.wav')
+        data = np.round(np.asarray(samples) * FULL_SCALE).astype('<i2')
+        outfile = wave.open(filename, 'wb')
+        outfile.setnchannels(channels)
+        outfile.setsampwidth(2)
+        outfile.setframerate(SAMPLE_RATE)
+        outfile.writeframes(data.tostring())
+        outfile.close()
+        return filename
+
+    def waitForLevels(self, sound, timeout=5):
+        end = time.time() + timeout
+        while sound.updated is None and time.time() < end:
+            time.sleep(0.01)
+        return sound.levels()
+
+    def test_tone(self):
+        # 440 Hz at 8 kHz hits its peak exactly: max 0.5, RMS 0.5/sqrt(2)
+        stream = SyntheticStream(amplitude=0.5, noise=0, realtime=False)
+        maximum, rms = self.waitForLevels(self.soundLevel(stream))
+        self.assertAlmostEqual(maximum, 0.5, places=4)
+        self.assertAlmostEqual(rms, 0.5 / np.sqrt(2), places=3)
+
+    def test_silence(self):
+        filename = self.writeWav(np.zeros(SAMPLE_RATE))
+        stream = WavStream(filename, realtime=False, loop=True)
+        self.assertEqual(self.waitForLevels(self.soundLevel(stream)), (0, 0))
+
+    def test_wav_first_channel(self):
+        # Square wave of amplitude 0.25 in the first channel, loud noise
+        # in the second one, which is ignored
+        square = 0.25 * np.sign(np.sin(2 * np.pi * 50 * np.arange(SAMPLE_RATE) / SAMPLE_RATE))
+        square[square == 0] = 0.25
+        noise = np.random.RandomState(0).uniform(-0.9, 0.9, SAMPLE_RATE)
+        filename = self.writeWav(np.column_stack((square, noise)), channels=2)
+        stream = WavStream(filename, realtime=False, loop=True)
+        maximum, rms = self.waitForLevels(self.soundLevel(stream, channels=2))
+        self.assertAlmostEqual(maximum, 0.25, places=4)
+        self.assertAlmostEqual(rms, 0.25, places=4)
+
+    def test_no_audio_yet(self):
+        stream = SilentStartStream()
+        sound = self.soundLevel(stream)
+        self.assertTrue(np.isnan(sound.level()))
+        self.assertRaises(IOError, sound.levels)
+        stream.released.set()
+
+    def test_stream_ended(self):
+        filename = self.writeWav(0.5 * np.ones(SAMPLE_RATE // 2))
+        sound = self.soundLevel(WavStream(filename, realtime=False))
+        sound.thread.join(5)
+        self.assertFalse(sound.running)
+        self.assertTrue(np.isnan(sound.level()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# Filename:     test_train.py
+# Regression test for algoFunctions.train against the loop-based
+# implementation it replaced
+#
+# Run from the top of the repository:
+#     python -m unittest discover -s tests
+
+import unittest
+import numpy as np
+
+from algoFunctions import train
+
+
+# The train() that the vectorized one replaced: per-feature generator sum
+# for gamma and per-row generator sum for the residual
+def referenceTrain(X, y):
+    Phi = X
+    t = y
+    (N, M) = np.shape(Phi)
+    alpha = 5*10**(-3)
+    beta = 5
+    max_iter = 100
+    k = 0
+
+    PhiT_Phi = np.dot(np.transpose(Phi), Phi)
+    PhiT_t = np.dot(np.transpose(Phi), t)
+    lam, V = np.linalg.eigh(PhiT_Phi)
+    lam = np.maximum(lam, 0)
+    VT_PhiT_t = np.dot(np.transpose(V), PhiT_t)
+
+    ab_old = np.array([alpha, beta])
+    ab_new = np.zeros((1,2))
+    tolerance = 10**-3
+    while( k < max_iter and np.linalg.norm(ab_old-ab_new) > tolerance):
+        k += 1
+        d = 1.0 / (alpha + beta*lam)
+        m_N = beta * np.dot(V, d * VT_PhiT_t)
+        gamma = sum(beta*lam[i] /(alpha + beta*lam[i]) for i in range(M))
+        ab_old = np.array([alpha, beta])
+        alpha = gamma /np.inner(m_N,m_N)
+        one_over_beta = 1/(N-gamma) * sum( (t[n] - np.inner(m_N, Phi[n]))**2 for n in range(N))
+        beta = 1/one_over_beta
+        ab_new = np.array([alpha, beta])
+
+    d = 1.0 / (alpha + beta*lam)
+    S_N = np.dot(V * d, np.transpose(V))
+    m_N = beta * np.dot(V, d * VT_PhiT_t)
+    return (m_N, alpha, beta, S_N)
+
+
+class TrainTest(unittest.TestCase):
+
+    def checkProblem(self, N, M, seed):
+        rng = np.random.RandomState(seed)
+        X = rng.rand(N, M) * 10
+        y = np.dot(X, rng.randn(M)) + rng.randn(N)
+
+        w_opt, alpha, beta, S_N = train(X, y)
+        w_ref, alpha_ref, beta_ref, S_ref = referenceTrain(X, y)
+
+        np.testing.assert_allclose(w_opt, w_ref, rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(alpha, alpha_ref, rtol=1e-9)
+        np.testing.assert_allclose(beta, beta_ref, rtol=1e-9)
+        np.testing.assert_allclose(S_N, S_ref, rtol=1e-9, atol=1e-15)
+
+    def test_matches_reference(self):
+        for seed, (N, M) in enumerate([(50, 3), (200, 8), (1000, 15), (3000, 30)]):
+            self.checkProblem(N, M, seed)
+
+    def test_full_output(self):
+        rng = np.random.RandomState(7)
+        X = rng.rand(300, 5)
+        y = np.dot(X, rng.randn(5)) + 0.1 * rng.randn(300)
+        result = train(X, y, full_output=True)
+        self.assertEqual(len(result), 5)
+        self.assertTrue(result[4]['converged'])
+
+
+if __name__ == '__main__':
+    unittest.main()
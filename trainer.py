@@ -0,0 +1,104 @@
+# Filename:     trainer.py
+# Author(s):    based on algo.py by apadin, dvorva, mjmor, yabskbd
+# Start Date:   2026-10-17
+
+"""Process pool for running BLR training sessions in the background.
+
+Algo.train normally runs inside Algo.run, so a slow training session
+blocks data collection, and several detectors in one program can only
+use a single core. A TrainingExecutor runs training jobs in worker
+processes instead. Any number of Algo instances can share one executor
+(see Algo.setExecutor); each keeps predicting with its previous model
+until the new one has been computed and is swapped in.
+
+"""
+
+
+#==================== LIBRARIES ====================#
+import time
+import threading
+import multiprocessing
+from collections import deque
+
+from algoFunctions import trainFromStats
+
+
+#==================== FUNCTIONS ====================#
+
+def _trainJob(PhiT_Phi, PhiT_t, tT_t, N, ab_init):
+    """Run trainFromStats in a worker process.
+
+    Returns (True, result) on success and (False, message) on failure, so
+    that a failed job can never take a worker down or go unreported.
+    """
+    try:
+        return (True, trainFromStats(PhiT_Phi, PhiT_t, tT_t, N,
+                                     ab_init=ab_init, full_output=True))
+    except (Exception, SystemExit) as error:
+        return (False, repr(error))
+
+
+#==================== CLASSES ====================#
+
+class TrainingExecutor(object):
+
+    def __init__(self, processes=None, history=100):
+        """
+        Start a pool of worker processes for training jobs.
+        'processes' defaults to the number of CPUs; 'history' is the
+        number of recent job latencies to keep for the metrics.
+        """
+        self.pool = multiprocessing.Pool(processes)
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=history)
+
+    def submit(self, PhiT_Phi, PhiT_t, tT_t, N, ab_init=None):
+        """
+        Queue a training job on the given sufficient statistics.
+        The arrays must not be modified afterwards, pass copies.
+        Returns a multiprocessing AsyncResult; its get() gives
+        (True, (w_opt, alpha, beta, S_N, info)) or (False, message).
+        """
+        submit_time = time.time()
+
+        def done(result):
+            # Runs in the pool's result handler thread
+            with self.lock:
+                self.completed += 1
+                if not result[0]:
+                    self.failed += 1
+                self.latencies.append(time.time() - submit_time)
+
+        with self.lock:
+            self.submitted += 1
+        return self.pool.apply_async(_trainJob, (PhiT_Phi, PhiT_t, tT_t, N, ab_init),
+                                     callback=done)
+
+    def queueDepth(self):
+        """Return the number of jobs submitted but not yet finished."""
+        with self.lock:
+            return self.submitted - self.completed
+
+    def metrics(self):
+        """Return a dictionary of queue and latency statistics."""
+        with self.lock:
+            latencies = list(self.latencies)
+            metrics = {
+                'queue_depth': self.submitted - self.completed,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+        if latencies:
+            metrics['last_latency'] = latencies[-1]
+            metrics['mean_latency'] = sum(latencies) / len(latencies)
+            metrics['max_latency'] = max(latencies)
+        return metrics
+
+    def close(self):
+        """Stop accepting jobs and wait for the workers to finish."""
+        self.pool.close()
+        self.pool.join()
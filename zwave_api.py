@@ -9,8 +9,8 @@ available
 
 #third party imports
 import socket
+import httplib
 import urllib2
-from urllib import urlopen as openurl
 
 class ZWave(object):
     """Class designed to store and retrieve information
@@ -29,6 +29,11 @@ class ZWave(object):
         self.devices = device_settings_dict
         #Add a connection status during intiatation
 
+        # One kept-alive connection is reused for every request
+        self._connection = None
+        self._request_count = 0
+        self._connection_count = 0
+
     @property
     def devices(self):
         """a property to return the devices to the user if
@@ -62,19 +67,66 @@ class ZWave(object):
                 keys_list.append(key)
         return sorted(keys_list)
 
+    def _open(self, url, timeout=5):
+        """Returns the body of the response to the given url,
+        using the kept-alive connection to the server. A broken
+        connection is re-opened once before giving up. Raises
+        urllib2.HTTPError if the server answers with an error status.
+        """
+        server_url = "http://" + self._server_ip + ":" + self._server_port
+        path = url[len(server_url):].replace(" ", "%20")
+        self._request_count += 1
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = httplib.HTTPConnection(
+                    self._server_ip, int(self._server_port), timeout=timeout)
+                self._connection_count += 1
+            try:
+                self._connection.request("GET", path)
+                response = self._connection.getresponse()
+                body = response.read()
+            except socket.timeout:
+                self._connection.close()
+                self._connection = None
+                raise
+            except (httplib.HTTPException, socket.error):
+                self._connection.close()
+                self._connection = None
+                continue
+            if not 200 <= response.status < 300:
+                raise urllib2.HTTPError(url, response.status, response.reason,
+                                        response.msg, None)
+            return body
+        raise urllib2.URLError("The url %s could not be reached" % url)
+
     def _check_connection(self):
         try:
             server_url = ("http://"
                           + self._server_ip + ":"
                           + self._server_port + "/")
-            response = urllib2.urlopen(server_url, timeout=5)
-            response.close()
+            self._open(server_url)
         except urllib2.URLError:
             raise urllib2.URLError("The url %s could not be reached"
                                    % server_url)
         except socket.timeout:
             raise socket.timeout("Connection to the server timed out")
 
+    def check_connection(self):
+        """Raises an exception if the server cannot be reached.
+        Meant to be called once per poll cycle, before reading
+        the devices with get_data(device_id, check_connection=False)
+        """
+        self._check_connection()
+
+    def connection_stats(self):
+        """Returns a dictionary with the number of requests made,
+        the number of connections opened for them, and how many
+        requests reused an already open connection
+        """
+        return {"requests": self._request_count,
+                "connections": self._connection_count,
+                "reused": self._request_count - self._connection_count}
+
     def _get_data_urls(self, device_id):
         #print "_get_data_urls device_id:", device_id
         urlbase = ("http://"
@@ -115,19 +167,21 @@ class ZWave(object):
                         + "].commandClasses["
                         + data_dict["command_class"]
                         + "].Get(sensorType = -1)")
-            openurl(full_url)
+            self._open(full_url)
 
-    def get_data(self, device_id):
+    def get_data(self, device_id, check_connection=True):
         """Returns a dictionary with key representing description
-        of data point and values being the data
+        of data point and values being the data. Set check_connection
+        to False if the connection was already checked for this poll
         """
         data_url_dict = self._get_data_urls(device_id)
-        self._check_connection()
+        if check_connection:
+            self._check_connection()
         device_name = self._devices[str(device_id)]["name"]
         data_dict = {}
         # make update sensor function here
         for unique_sensor, info_list in data_url_dict.iteritems():
-            url_data = (urllib2.urlopen(info_list[0])).read()
+            url_data = self._open(info_list[0])
             url_data = url_data.strip()
             if info_list[1] == "bool":
                 # see if its a number that needs to be converted to bool
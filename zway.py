@@ -21,7 +21,14 @@ a way to parse this information from the devices page.
 #==================== LIBRARIES ====================#
 import os
 import json
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from multiprocessing.pool import ThreadPool
+
+
+#==================== PARAMETERS ====================#
+POOL_SIZE = 8   # Number of concurrent requests / kept-alive connections
 
 
 #==================== CLASSES ====================#
@@ -34,10 +41,23 @@ class Server(object):
         a list of available devices.
         """
                 
+        self.pool = None
+
+        # All requests go through one session, which keeps its
+        # connections to the server alive between requests
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE))
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+        # Local copy of the server's data tree used by get_snapshot
+        self.tree = None
+        self.tree_time = None
+
         # Check connection to the host
         self.base_url = "http://{}:{}/ZWaveAPI/".format(host, port)
         try:
-            requests.post(self.base_url + "Data")
+            self._post("Data")
         except Exception:
             raise Exception("connection could not be established")
         
@@ -46,6 +66,7 @@ class Server(object):
             self.update_devices()
         else:
             self.devices = device_dict
+            self._build_index()
 
     def update_devices(self):
         """
@@ -54,7 +75,7 @@ class Server(object):
         """
         
         self.devices = {}
-        devices_page = requests.post(self.base_url + "Run/devices").json()
+        devices_page = self._post("Run/devices").json()
 
         for device_id_base in devices_page:
             device_count = 0
@@ -86,7 +107,23 @@ class Server(object):
                                 name = device_id_base + '_' + sensor_type
                                 self.devices[device_id]['name'] = name
 
+        self._build_index()
         return self.devices
+
+    def _build_index(self):
+        """
+        Precompute, for every sensor in sorted device ID order, the keys
+        leading to its value in the data tree, so that get_snapshot can
+        look values up without building any strings.
+        """
+        self.index = []
+        for device_id in sorted(self.device_IDs()):
+            data = self.devices[device_id]['data']
+            leaf = data['url_suffix'].lstrip('.').split('.')[0]
+            keys = (str(int(float(device_id))), 'instances', data['instance_num'],
+                    'commandClasses', data['command_class'],
+                    'data', data['data_num'], leaf, 'value')
+            self.index.append((keys, data['type']))
     
     def device_IDs(self):
         """Return a list of available device IDs"""
@@ -94,18 +131,107 @@ class Server(object):
 
     def software_version(self):
         """Get the version of ZWay software running on this server"""
-        command = self.base_url + "Data"
-        Data_dict = requests.post(self.base_url + command).json()
+        Data_dict = self._post("Data").json()
         return Data_dict['controller']['data']['softwareRevisionVersion']
         
     def battery_level(self, device_id):
         instance = self.devices[str(device_id)]['data']['instance_num']
         command = "Run/devices[{}].instances[0].Battery.data.last.value".format(device_id, instance)
-        battery_percent = requests.post(self.base_url + command).content
+        battery_percent = self._post(command).content
         return int(battery_percent)
         
     def get_data(self, device_id):
         """Fetch the data from this sensor given device ID and device information"""
+        self._refresh(self._refresh_command(device_id))
+        return self._read(device_id)
+
+    def get_all_data(self, timeout=5, threads=POOL_SIZE):
+        """
+        Fetch the data from all sensors, issuing the requests concurrently.
+        All sensors are refreshed first, then all values are read. Each
+        request gives up after 'timeout' seconds.
+        Returns a list of values ordered by sorted device ID; a sensor
+        which could not be read gives -1.
+        """
+        if self.pool is None:
+            self.pool = ThreadPool(threads)
+        device_ids = sorted(self.device_IDs())
+
+        # Sensors on the same instance and command class share one refresh
+        commands = sorted(set(self._refresh_command(device_id) for device_id in device_ids))
+
+        def refresh(command):
+            try:
+                self._refresh(command, timeout)
+            except requests.RequestException:
+                pass
+
+        def read(device_id):
+            try:
+                return self._read(device_id, timeout)
+            except (requests.RequestException, ValueError):
+                return -1
+
+        self.pool.map(refresh, commands)
+        return self.pool.map(read, device_ids)
+
+    def get_snapshot(self, timeout=5, incremental=True):
+        """
+        Fetch the data from all sensors with a single request and return
+        it in the same order as get_all_data; missing values give -1.
+        The first call fetches the whole data tree. Later calls, if
+        'incremental' is set, only fetch the changes since the previous
+        call (the Data/<timestamp> endpoint) and apply them to the local
+        copy. Unlike get_all_data, sensors are not asked to refresh;
+        this relies on the devices reporting their values on their own.
+        """
+        if self.tree is None or not incremental:
+            data_page = self._post("Data/0", timeout).json()
+            self.tree = data_page.get('devices', {})
+        else:
+            data_page = self._post("Data/{}".format(self.tree_time), timeout).json()
+            for path, value in data_page.iteritems():
+                keys = path.split('.')
+                if keys[0] == 'devices' and len(keys) > 1:
+                    self._set_tree_node(keys[1:], value)
+        self.tree_time = data_page.get('updateTime', self.tree_time)
+
+        values = []
+        for keys, data_type in self.index:
+            node = self.tree
+            try:
+                for key in keys:
+                    node = node[key]
+                if (data_type == 'bool'):
+                    values.append(1.0 if node else 0.0)
+                else:
+                    values.append(float(node))
+            except (KeyError, TypeError, ValueError):
+                values.append(-1)
+        return values
+
+    def _set_tree_node(self, keys, value):
+        """Replace the node of the local data tree found at 'keys'."""
+        node = self.tree
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        node[keys[-1]] = value
+
+    def _refresh_command(self, device_id):
+        """Return the command which makes this sensor update its data."""
+        device_id = str(device_id)
+        instance_num  = self.devices[device_id]['data']['instance_num']
+        command_class = self.devices[device_id]['data']['command_class']
+        device        = int(float(device_id))
+        command = "Run/devices[{}].instances[{}].commandClasses[{}].Get(sensorType=-1)"
+        return command.format(device, instance_num, command_class)
+
+    def _refresh(self, command, timeout=None):
+        """Ask a sensor to update its data."""
+        self._post(command, timeout).content
+
+    def _read(self, device_id, timeout=None):
+        """Retrieve the current data of a sensor."""
         device_id = str(device_id)
         instance_num  = self.devices[device_id]['data']['instance_num']
         command_class = self.devices[device_id]['data']['command_class']
@@ -113,16 +239,10 @@ class Server(object):
         data_type     = self.devices[device_id]['data']['type']
         suffix        = self.devices[device_id]['data']['url_suffix']
         device        = int(float(device_id))
-        
-        # Update the device
-        command = "Run/devices[{}].instances[{}].commandClasses[{}].Get(sensorType=-1)"
-        command = command.format(device, instance_num, command_class)
-        requests.post(self.base_url + command).content
 
-        # Retrieve data
         command = "Run/devices[{}].instances[{}].commandClasses[{}].data[{}].{}"
         command = command.format(device, instance_num, command_class, data_num, suffix)
-        data = requests.post(self.base_url + command).content
+        data = self._post(command, timeout).content
         
         if (data_type == 'bool'):
             data = 1 if (data == 'true') else 0
@@ -140,8 +260,27 @@ class Server(object):
         # Issue the command
         command = "Run/devices[{}].instances[{}].commandClasses[{}].data[{}].sensorTypeString.value"
         command = command.format(device, instance_num, command_class, data_num)
-        return requests.post(self.base_url + command).content
+        return self._post(command).content
         
+    def _post(self, command, timeout=None):
+        """Issue a command to the server on the shared session."""
+        with self.lock:
+            self.request_count += 1
+        return self.session.post(self.base_url + command, timeout=timeout)
+
+    def connection_stats(self):
+        """
+        Return a dictionary with the number of requests issued, the number
+        of connections opened for them, and how many requests reused an
+        already open connection.
+        """
+        adapter = self.session.get_adapter(self.base_url)
+        connection_pool = adapter.poolmanager.connection_from_url(self.base_url)
+        connections = connection_pool.num_connections
+        return {'requests': self.request_count,
+                'connections': connections,
+                'reused': self.request_count - connections}
+
     def sensor_name(self, device_id):
         """Return string representing the name of this device."""
         return self.devices[device_id]['name']